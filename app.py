@@ -1,491 +1,84 @@
-def generate_html_report(analysis, veteran_info):
-    """Generate comprehensive HTML report with real data and Senior Rater analysis"""
-    
-    # Build conditions table with enhanced Senior Rater analysis
-    current_conditions_html = ""
-    for condition in analysis.get('current_conditions', []):
-        probability_class = condition.get('probability', 'medium').lower()
-        potential_increase = condition.get('potential_rating', 0) - condition.get('current_rating', 0)
-        
-        current_conditions_html += f"""
-        <tr>
-            <td>
-                <strong>{condition.get('name', 'Unknown')}</strong><br>
-                <small>Code: {condition.get('diagnostic_code', 'N/A')} | {condition.get('cfr_citation', 'CFR TBD')}</small>
-            </td>
-            <td class="text-center">{condition.get('current_rating', 0)}%</td>
-            <td class="text-center">
-                <strong>{condition.get('potential_rating', 0)}%</strong>
-                {f'<br><small style="color: #059669">(+{potential_increase}%)</small>' if potential_increase > 0 else ''}
-            </td>
-            <td><span class="priority-{probability_class}">{condition.get('probability', 'Unknown')}</span></td>
-            <td>{condition.get('evidence', 'No evidence noted')[:100]}...</td>
-            <td>{condition.get('action_required', 'Review needed')}</td>
-        </tr>
-        """
-    
-    # Build new opportunities with enhanced details
-    new_opportunities_html = ""
-    for opp in analysis.get('new_opportunities', []):
-        success_prob = opp.get('success_probability', 'Medium').lower()
-        
-        new_opportunities_html += f"""
-        <div class="opportunity">
-            <div class="opportunity-header">
-                <h4>🎯 {opp.get('condition', 'New Opportunity')}</h4>
-                <div class="opportunity-badges">
-                    <span class="rating-badge">{opp.get('potential_rating', 0)}%</span>
-                    <span class="probability-badge priority-{success_prob}">{opp.get('success_probability', 'Medium')}</span>
-                </div>
-            </div>
-            <div class="opportunity-content">
-                <p><strong>Connection Type:</strong> {opp.get('connection_type', 'Unknown')}</p>
-                <p><strong>Diagnostic Code:</strong> {opp.get('diagnostic_code', 'TBD')}</p>
-                <p><strong>CFR Citation:</strong> {opp.get('cfr_citation', 'TBD')}</p>
-                <p><strong>Evidence Found:</strong> {opp.get('evidence', 'Evidence to be gathered')}</p>
-                <p><strong>Action Required:</strong> {opp.get('action_required', 'Contact for details')}</p>
-            </div>
-        </div>
-        """
-    
-    # Build strategic action plan with Senior Rater priorities
-    action_plan_html = ""
-    for action in analysis.get('strategic_plan', []):
-        priority_class = action.get('priority', 'Medium').lower()
-        action_plan_html += f"""
-        <div class="action-item {priority_class}">
-            <div class="action-header">
-                <h4>📋 {action.get('title', 'Action Item')}</h4>
-                <span class="priority-badge priority-{priority_class}">{action.get('priority', 'Medium')} Priority</span>
-            </div>
-            <div class="action-content">
-                <p><strong>Description:</strong> {action.get('description', 'No description')}</p>
-                <p><strong>Timeline:</strong> {action.get('timeline', 'TBD')}</p>
-                <p><strong>Expected Impact:</strong> {action.get('impact', 'TBD')}</p>
-                <p><strong>CFR Basis:</strong> {action.get('cfr_basis', 'Regulatory review needed')}</p>
-            </div>
-        </div>
-        """
-    
-    # Build evidence gaps with Senior Rater specificity
-    evidence_gaps_html = ""
-    for gap in analysis.get('evidence_gaps', []):
-        evidence_gaps_html += f"<li>{gap}</li>"
-    
-    # Build Special Monthly Compensation section
-    smc_info = analysis.get('special_monthly_compensation', {})
-    smc_html = ""
-    if smc_info.get('eligible', False):
-        smc_html = f"""
-        <div class="smc-section">
-            <h3>💰 Special Monthly Compensation (SMC) Analysis</h3>
-            <div class="smc-eligible">
-                <p><strong>Eligible:</strong> <span class="priority-high">YES</span></p>
-                <p><strong>Type:</strong> {smc_info.get('type', 'To be determined')}</p>
-                <p><strong>Additional Monthly:</strong> <span style="color: #059669; font-weight: bold;">${smc_info.get('additional_monthly', 0):,}</span></p>
-                <p><strong>Requirements:</strong> {smc_info.get('requirements', 'Under review')}</p>
-            </div>
-        </div>
-        """
-    
-    # Build pyramiding analysis
-    pyramiding_info = analysis.get('pyramiding_analysis', {})
-    pyramiding_html = ""
-    if pyramiding_info:
-        pyramiding_html = f"""
-        <div class="pyramiding-section">
-            <h3>⚖️ Pyramiding Rule Analysis</h3>
-            <div class="pyramiding-content">
-                <h4>Potential Issues:</h4>
-                <ul>
-                    {chr(10).join([f'<li>{issue}</li>' for issue in pyramiding_info.get('potential_issues', [])])}
-                </ul>
-                <h4>Recommendations:</h4>
-                <ul>
-                    {chr(10).join([f'<li>{rec}</li>' for rec in pyramiding_info.get('recommendations', [])])}
-                </ul>
-            </div>
-        </div>
-        """
-    
-    # Get rating calculations with enhanced display
-    combined_rating = analysis.get('combined_rating', {})
-    current_rating = combined_rating.get('current', 0)
-    potential_rating = combined_rating.get('potential', 0)
-    current_monthly = combined_rating.get('current_monthly', 0)
-    potential_monthly = combined_rating.get('potential_monthly', 0)
-    monthly_increase = potential_monthly - current_monthly
-    annual_increase = monthly_increase * 12
-    
-    # Generate complete HTML report with Senior Rater analysis
-    report_html = f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>VA Senior Rater Analysis - {veteran_info['name']}</title>
-        <style>
-            body {{
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                line-height: 1.6;
-                margin: 0;
-                padding: 0;
-                background-color: #f5f5f5;
-                color: #333;
-            }}
-            .container {{
-                max-width: 1200px;
-                margin: 0 auto;
-                background: white;
-                box-shadow: 0 0 20px rgba(0,0,0,0.1);
-            }}
-            .header {{
-                background: linear-gradient(135deg, #1e3c72 0%, #2a5298 100%);
-                color: white;
-                padding: 40px 30px;
-                text-align: center;
-                position: relative;
-            }}
-            .logo {{
-                position: absolute;
-                top: 20px;
-                left: 30px;
-                height: 60px;
-                width: auto;
-            }}
-            .header h1 {{
-                margin: 0 0 10px 0;
-                font-size: 32px;
-                font-weight: bold;
-            }}
-            .header .subtitle {{
-                font-size: 18px;
-                opacity: 0.9;
-                margin-bottom: 20px;
-            }}
-            .file-info {{
-                background: rgba(255,255,255,0.1);
-                padding: 15px;
-                border-radius: 8px;
-                margin: 20px 0 0 0;
-                font-size: 14px;
-                backdrop-filter: blur(10px);
-            }}
-            .executive-summary {{
-                background: linear-gradient(135deg, #e8f4f8 0%, #d1e7dd 100%);
-                border-left: 6px solid #2a5298;
-                padding: 30px;
-                margin: 0;
-            }}
-            .summary-stats {{
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(200px, 1fr));
-                gap: 20px;
-                margin-top: 20px;
-            }}
-            .stat-card {{
-                background: white;
-                padding: 20px;
-                border-radius: 8px;
-                text-align: center;
-                box-shadow: 0 2px 10px rgba(0,0,0,0.1);
-                transition: transform 0.2s ease;
-            }}
-            .stat-card:hover {{
-                transform: translateY(-2px);
-            }}
-            .stat-number {{
-                font-size: 28px;
-                font-weight: bold;
-                color: #1e3c72;
-            }}
-            .stat-label {{
-                color: #666;
-                font-size: 14px;
-                margin-top: 5px;
-            }}
-            .increase {{
-                color: #28a745 !important;
-            }}
-            .section {{
-                margin: 0;
-                padding: 30px;
-                border-bottom: 1px solid #eee;
-            }}
-            .section h2 {{
-                color: #1e3c72;
-                border-bottom: 3px solid #2a5298;
-                padding-bottom: 15px;
-                font-size: 24px;
-                margin-bottom: 25px;
-            }}
-            .conditions-table {{
-                width: 100%;
-                border-collapse: collapse;
-                margin: 20px 0;
-                background: white;
-                border-radius: 8px;
-                overflow: hidden;
-                box-shadow: 0 2px 8px rgba(0,0,0,0.1);
-            }}
-            .conditions-table th,
-            .conditions-table td {{
-                border: 1px solid #ddd;
-                padding: 15px;
-                text-align: left;
-            }}
-            .conditions-table th {{
-                background: linear-gradient(135deg, #f8f9fa 0%, #e9ecef 100%);
-                font-weight: bold;
-                color: #1e3c72;
-                font-size: 14px;
-            }}
-            .conditions-table tr:nth-child(even) {{
-                background-color: #f8f9fa;
-            }}
-            .conditions-table tr:hover {{
-                background-color: #e3f2fd;
-            }}
-            .text-center {{
-                text-align: center !important;
-            }}
-            .priority-high {{ 
-                color: #28a745; 
-                font-weight: bold; 
-                background: #d4edda;
-                padding: 3px 8px;
-                border-radius: 4px;
-            }}
-            .priority-medium {{ 
-                color: #fd7e14; 
-                font-weight: bold; 
-                background: #fff3cd;
-                padding: 3px 8px;
-                border-radius: 4px;
-            }}
-            .priority-low {{ 
-                color: #6c757d; 
-                background: #f8f9fa;
-                padding: 3px 8px;
-                border-radius: 4px;
-            }}
-            .opportunity {{
-                background: linear-gradient(135deg, #d4edda 0%, #c3e6cb 100%);
-                border: 1px solid #c3e6cb;
-                border-left: 6px solid #28a745;
-                border-radius: 12px;
-                padding: 25px;
-                margin: 20px 0;
-                box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-            }}
-            .opportunity-header {{
-                display: flex;
-                justify-content: space-between;
-                align-items: center;
-                margin-bottom: 15px;
-                flex-wrap: wrap;
-            }}
-            .opportunity-header h4 {{
-                color: #155724;
-                font-size: 20px;
-                margin: 0;
-            }}
-            .opportunity-badges {{
-                display: flex;
-                gap: 10px;
-                align-items: center;
-            }}
-            .rating-badge {{
-                background: #28a745;
-                color: white;
-                padding: 5px 12px;
-                border-radius: 20px;
-                font-weight: bold;
-                font-size: 14px;
-            }}
-            .probability-badge {{
-                padding: 3px 8px;
-                border-radius: 4px;
-                font-size: 12px;
-                font-weight: bold;
-            }}
-            .opportunity-content p {{
-                margin: 10px 0;
-                font-size: 15px;
-            }}
-            .action-item {{
-                background: white;
-                border: 1px solid #ffeaa7;
-                border-left: 6px solid #f39c12;
-                border-radius: 12px;
-                padding: 25px;
-                margin: 20px 0;
-                box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-                transition: transform 0.2s ease;
-            }}
-            .action-item:hover {{
-                transform: translateY(-2px);
-            }}
-            .action-item.high {{
-                border-left-color: #e74c3c;
-                background: linear-gradient(135deg, #fdf2f2 0%, #fecaca 100%);
-            }}
-            .action-item.medium {{
-                border-left-color: #f39c12;
-                background: linear-gradient(135deg, #fffbeb 0%, #fef3c7 100%);
-            }}
-            .action-item.low {{
-                border-left-color: #17a2b8;
-                background: linear-gradient(135deg, #f0f9ff 0%, #dbeafe 100%);
-            }}
-            .action-header {{
-                display: flex;
-                justify-content: space-between;
-                align-items: center;
-                margin-bottom: 15px;
-                flex-wrap: wrap;
-            }}
-            .action-header h4 {{
-                color: #1e3c72;
-                font-size: 18px;
-                margin: 0;
-            }}
-            .priority-badge {{
-                padding: 5px 12px;
-                border-radius: 20px;
-                font-size: 12px;
-                font-weight: bold;
-                color: white;
-            }}
-            .priority-badge.priority-high {{
-                background: #e74c3c;
-            }}
-            .priority-badge.priority-medium {{
-                background: #f39c12;
-            }}
-            .priority-badge.priority-low {{
-                background: #17a2b8;
-            }}
-            .action-content p {{
-                margin: 8px 0;
-                font-size: 15px;
-            }}
-            .smc-section {{
-                background: linear-gradient(135deg, #fff3cd 0%, #ffeaa7 100%);
-                border-left: 6px solid #ffc107;
-                padding: 20px;
-                margin: 20px 0;
-                border-radius: 8px;
-            }}
-            .smc-section h3 {{
-                color: #856404;
-                margin-top: 0;
-            }}
-            .smc-eligible {{
-                background: white;
-                padding: 15px;
-                border-radius: 8px;
-                box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-            }}
-            .pyramiding-section {{
-                background: linear-gradient(135deg, #e2e3e5 0%, #d1ecf1 100%);
-                border-left: 6px solid #17a2b8;
-                padding: 20px;
-                margin: 20px 0;
-                border-radius: 8px;
-            }}
-            .pyramiding-section h3 {{
-                color: #0c5460;
-                margin-top: 0;
-            }}
-            .pyramiding-content {{
-                background: white;
-                padding: 15px;
-                border-radius: 8px;
-                box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-            }}
-            .pyramiding-content h4 {{
-                color: #1e3c72;
-                margin-top: 15px;
-                margin-bottom: 10px;
-            }}
-            .pyramiding-content ul {{
-                margin: 10px 0;
-                padding-left: 20px;
-            }}
-            .pyramiding-content li {{
-                margin: 5px 0;
-                line-height: 1.5;
-            }}
-            .footer {{
-                background: #f8f9fa;
-                padding: 30px;
-                text-align: center;
-                font-size: 14px;
-                color: #666;
-                border-top: 3px solid #dee2e6;
-            }}
-            .disclaimer {{
-                background: #fff3cd;
-                border: 1px solid #ffeaa7;
-                border-radius: 8px;
-                padding: 15px;
-                margin: 20px 0;
-                color: #856404;
-            }}
-            .senior-rater-badge {{
-                background: #1e3c72;
-                color: white;
-                padding: 8px 15px;
-                border-radius: 25px;
-                font-size: 12px;
-                font-weight: bold;
-                display: inline-block;
-                margin: 10px 0;
-            }}
-            .calculation-details {{
-                background: #f8f9fa;
-                border: 1px solid #dee2e6;
-                border-radius: 8px;
-                padding: 15px;
-                margin: 15px 0;
-                font-family: 'Courier New', monospace;
-                font-size: 14px;
-            }}
-            
-            /* Mobile Responsive */
-            @media (max-width: 768px) {{
-                .logo {{
-                    height: 40px;
-                    top: 15px;
-                    left: 15px;
-                }}
-                .header {{
-                    padding: 25px 15px;
-                }}
-                .header h1 {{
-                    font-size: 24px;
-                    margin-top: 15px;
-                }}
-                .section {{
-                    padding: 20px 15px;
-                }}
-                .summary-stats {{
-                    grid-template-columns: 1fr;# Complete VA Claims Analysis System - Updated for Real Zoho Webhook Format
+# Complete VA Claims Analysis System - Updated for Real Zoho Webhook Format
 # Handles the actual webhook payload structure from Zoho WorkDrive
 
-from flask import Flask, request, jsonify
-import requests
-import json
+from quart import Quart, Response, request, jsonify
+from quart.json.provider import DefaultJSONProvider
+from werkzeug.exceptions import HTTPException
+import httpx
+import orjson
 import os
-from datetime import datetime
-import openai
+import re
+import sqlite3
+import asyncio
+import atexit
+import copy
+import functools
+import hashlib
+import logging
+import logging.handlers
+import queue
+import sys
+import time
+import uuid
+import zlib
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from urllib.parse import unquote
+from jinja2 import Environment, FileSystemLoader
+import anthropic
+
+# Log records are queued and written by a listener thread, so a slow stdout
+# (container log pipes) never blocks the event loop mid-request
+logger = logging.getLogger('vaclaims')
+logger.setLevel(logging.INFO)
+logger.propagate = False
+log_queue_handler = logging.handlers.QueueHandler(queue.SimpleQueue())
+logger.addHandler(log_queue_handler)
+log_stream_handler = logging.StreamHandler(sys.stdout)
+log_listener: Optional[logging.handlers.QueueListener] = None
+
+def start_log_listener() -> None:
+    """Start the thread that writes queued log records"""
+    global log_listener
+    log_listener = logging.handlers.QueueListener(log_queue_handler.queue, log_stream_handler)
+    log_listener.start()
 
-app = Flask(__name__)
+def restart_log_listener_after_fork() -> None:
+    """Give a forked gunicorn worker its own queue and writer thread (threads don't survive fork)"""
+    log_queue_handler.queue = queue.SimpleQueue()
+    start_log_listener()
+
+def stop_log_listener() -> None:
+    """Flush queued log records on interpreter exit"""
+    if log_listener is not None:
+        log_listener.stop()
+
+start_log_listener()
+os.register_at_fork(after_in_child=restart_log_listener_after_fork)
+atexit.register(stop_log_listener)
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Serialize jsonify() responses with orjson instead of the stdlib encoder"""
+    
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        # orjson never sorts keys or escapes to ASCII: output keeps insertion order
+        # and raw UTF-8. datetime, UUID and dataclasses are native to orjson; anything else
+        # (Decimal, Markup, date) falls through to Quart's default handler
+        option = orjson.OPT_NON_STR_KEYS
+        if 'indent' in kwargs:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option).decode()
+    
+    def loads(self, s: Any, **kwargs: Any) -> Any:
+        return orjson.loads(s)
+
+app = Quart(__name__)
+app.json = OrjsonProvider(app)
 
 # Configuration from environment variables
-OPENAI_API_KEY = os.getenv('OPENAI_API_KEY', 'your-openai-key-here')
+ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY', 'your-anthropic-key-here')
+CLAUDE_MODEL = os.getenv('CLAUDE_MODEL', 'claude-3-5-sonnet-20241022')
 ZOHO_ACCESS_TOKEN = os.getenv('ZOHO_ACCESS_TOKEN', 'your-zoho-token')
 ZOHO_REPORTS_FOLDER_ID = os.getenv('ZOHO_REPORTS_FOLDER_ID', 'your-reports-folder-id')
 ZOHO_VETREPORTS_FOLDER_ID = os.getenv('ZOHO_VETREPORTS_FOLDER_ID', 'your-vetreports-folder-id')
@@ -502,66 +95,300 @@ VA_COMPENSATION_RATES = {
     70: 1716, 80: 1995, 90: 2241, 100: 3737
 }
 
-@app.route('/', methods=['GET'])
+# Rate-limited (429), overloaded (529), other 5xx and dropped connections are retried
+# by the SDK with exponential backoff (honoring Claude's retry-after header) rather
+# than silently falling back to a generic analysis. This is the only retry layer, so
+# a synchronous webhook waits on at most CLAUDE_MAX_RETRIES + 1 calls.
+CLAUDE_MAX_RETRIES = 4
+
+@functools.cache
+def get_anthropic_client() -> anthropic.AsyncAnthropic:
+    """Async Claude client shared by all in-flight webhooks, built on first use"""
+    return anthropic.AsyncAnthropic(
+        api_key=ANTHROPIC_API_KEY,
+        max_retries=CLAUDE_MAX_RETRIES,
+        timeout=httpx.Timeout(60.0, connect=5.0)
+    )
+
+# Cap concurrent Claude calls per worker so bursts of webhooks don't trip the org rate limit
+claude_semaphore = asyncio.Semaphore(5)
+
+# Only the head of each medical record reaches the Claude prompt,
+# so stop reading the download once this many bytes are buffered
+MEDICAL_TEXT_PROMPT_CHARS = 8000
+MEDICAL_RECORDS_DOWNLOAD_LIMIT = 32 * 1024
+MEDICAL_RECORDS_DOWNLOAD_CHUNK = 4 * 1024
+
+# Circuit breaker for WorkDrive downloads: after this many consecutive outages
+# (timeouts, connection errors, 5xx) skip Zoho for the cool-down instead of
+# letting every webhook wait out the 30 s timeout
+ZOHO_BREAKER_FAIL_MAX = 5
+ZOHO_BREAKER_RESET_SECONDS = 60
+zoho_breaker: Dict[str, Any] = {'failures': 0, 'opened_at': None}
+
+# Parsed Claude analyses keyed on the medical text, so webhook retries and
+# re-uploads of the same document skip the LLM round-trip
+ANALYSIS_CACHE_TTL_SECONDS = 7 * 24 * 60 * 60
+ANALYSIS_CACHE_MAX_ENTRIES = 512
+analysis_cache: 'OrderedDict[str, tuple]' = OrderedDict()
+
+# Optional on-disk tier behind the in-memory cache (a SQLite file path), shared by
+# every worker on the host and kept across restarts and deploys; it also holds the
+# batch and background job registries below
+ANALYSIS_CACHE_DB = os.getenv('ANALYSIS_CACHE_DB')
+# Every query runs on the event loop, so wait only briefly for another worker's write
+# lock; a timeout is handled like any other database error
+SHARED_DB_BUSY_TIMEOUT_SECONDS = 0.25
+
+# Finished analyses and rendered reports keyed on (file_id, medical text), so a
+# re-fired webhook for the same upload skips both Claude and the template render;
+# entries expire after an hour without use
+REPORT_CACHE_TTL_SECONDS = 60 * 60
+REPORT_CACHE_MAX_ENTRIES = 256
+report_cache: 'OrderedDict[str, tuple]' = OrderedDict()
+
+# Opt-in Message Batches mode for bulk ingest days: webhooks are coalesced for a
+# short window and submitted as one batch (half the per-token cost), and the
+# webhook returns 202 with a job ID instead of waiting on Claude
+CLAUDE_BATCH_MODE = os.getenv('CLAUDE_BATCH_MODE', 'false').lower() == 'true'
+CLAUDE_BATCH_WINDOW_SECONDS = 5.0
+CLAUDE_BATCH_MAX_REQUESTS = 100
+CLAUDE_BATCH_POLL_SECONDS = 30.0
+claude_batch_queue: asyncio.Queue = asyncio.Queue()
+
+# Job status polled through /batch-status/<job_id>. With ANALYSIS_CACHE_DB set, jobs
+# are stored in that shared file so any worker can answer the poll; otherwise they
+# stay in this worker's memory and gunicorn_conf.py runs a single worker. Jobs are
+# forgotten a day after their last update.
+JOB_STATUS_TTL_SECONDS = 24 * 60 * 60
+JOB_STATUS_MAX_ENTRIES = 1024
+job_registries: Dict[str, 'OrderedDict[str, tuple]'] = {
+    'claude_batch_jobs': OrderedDict(),
+    'pipeline_jobs': OrderedDict()
+}
+
+# Opt-in background mode: webhooks are acknowledged with 202 straight away and the whole
+# pipeline (download included) runs as a background task, tracked in pipeline_jobs
+# so /batch-status/<job_id> reports it. Zoho retries of an in-flight upload reuse its
+# job; one that hasn't progressed for half an hour is assumed lost with its worker.
+WEBHOOK_BACKGROUND_MODE = os.getenv('WEBHOOK_BACKGROUND_MODE', 'false').lower() == 'true'
+PIPELINE_JOB_STALE_SECONDS = 30 * 60
+PIPELINE_JOB_IN_FLIGHT_STATUSES = ('queued', 'processing')
+
+ZOHO_CONNECT_RETRIES = 2
+
+@functools.cache
+def get_zoho_client() -> httpx.AsyncClient:
+    """
+    Pooled keep-alive client reused for every Zoho call, so only the first request
+    to a host pays the TCP+TLS handshake (HTTP/2 multiplexes the rest).
+    Built lazily so importing the app (or forking workers) opens no connections.
+    """
+    return httpx.AsyncClient(
+        # Connection failures (DNS, refused, TLS reset) are retried by the transport
+        # before they count against the WorkDrive circuit breaker
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            retries=ZOHO_CONNECT_RETRIES
+        ),
+        timeout=30.0,
+        follow_redirects=True,
+        headers={
+            'Authorization': f'Zoho-oauthtoken {ZOHO_ACCESS_TOKEN}',
+            'User-Agent': 'VA-Claims-Analysis-System/3.0'
+        }
+    )
+
+@app.before_serving
+async def open_api_clients():
+    """Build the Claude and Zoho pools in each worker, on that worker's event loop"""
+    get_anthropic_client()
+    get_zoho_client()
+    app.add_background_task(warm_anthropic_connection)
+
+async def warm_anthropic_connection():
+    """Open the TLS connection to the Claude API before the first webhook needs it"""
+    # Listing models is free and leaves a keep-alive connection in the pool
+    try:
+        await get_anthropic_client().models.list(limit=1)
+        logger.info("🔥 Claude API connection warmed")
+    except anthropic.APIError as e:
+        logger.warning("⚠️ Could not pre-warm Claude API connection: %s", e)
+
+@app.after_serving
+async def close_api_clients():
+    """Close pooled connections on worker shutdown"""
+    await get_zoho_client().aclose()
+    await get_anthropic_client().close()
+
+@functools.cache
+def get_missing_config() -> List[str]:
+    """Names of required settings still unset or left at their placeholder defaults"""
+    # Checked against the values already read into module constants at import;
+    # gunicorn's master calls this once and workers inherit the result
+    required_vars = {
+        'ANTHROPIC_API_KEY': ANTHROPIC_API_KEY,
+        'ZOHO_ACCESS_TOKEN': ZOHO_ACCESS_TOKEN,
+        'ZOHO_REPORTS_FOLDER_ID': ZOHO_REPORTS_FOLDER_ID
+    }
+    return [
+        var for var, value in required_vars.items()
+        if not value or value.startswith('your-')
+    ]
+
+@app.errorhandler(Exception)
+async def handle_unexpected_error(error: Exception):
+    """JSON error envelope for exceptions a route does not handle itself"""
+    # 404s, 405s and other HTTP errors keep Quart's own responses
+    if isinstance(error, HTTPException):
+        return error
+    
+    logger.error("❌ Unhandled error on %s: %s", request.path, error)
+    return jsonify({
+        'success': False,
+        'error': str(error),
+        'timestamp': datetime.now().isoformat()
+    }), 500
+
+@app.route('/', methods=['GET', 'HEAD'])
 def health_check():
     """Health check endpoint"""
+    # Load balancer probes only look at the status code, so skip building the JSON body
+    if request.method == 'HEAD':
+        return '', 200
+    
     return jsonify({
         'status': 'active',
         'service': 'VA Claims Analysis System - Claude Integration',
         'timestamp': datetime.now().isoformat(),
         'version': '3.0 - Complete Claude Integration with Senior Rater Mode',
-        'ai_backend': 'Claude-3.5-Sonnet (Anthropic)'
+        'ai_backend': 'Claude-3.5-Sonnet (Anthropic)',
+        'workdrive_circuit': get_zoho_breaker_state()
     })
 
 @app.route('/process-va-records', methods=['POST'])
-def process_va_records():
+async def process_va_records():
     """
     Main processing endpoint - handles Zoho WorkDrive webhook payload with Claude analysis
     """
+    # One clock read per webhook so the report ID, metadata and response agree
+    now = datetime.now()
+    webhook_data = None
     try:
-        print("🚀 Starting VA Claims Analysis with Claude Senior Rater...")
+        logger.info("🚀 Starting VA Claims Analysis with Claude Senior Rater...")
         
-        # Get the webhook payload
-        webhook_data = request.json
+        # Get the webhook payload; malformed JSON or a non-object body is the sender's error
+        webhook_data = await read_webhook_payload()
+        if webhook_data is None:
+            logger.warning("⚠️ Rejecting webhook whose body is not a JSON object")
+            return jsonify({
+                'success': False,
+                'error': 'Webhook payload must be a JSON object',
+                'timestamp': now.isoformat(),
+                'webhook_received': True
+            }), 400
         
         # Log the webhook event
         webhook_event = webhook_data.get('webhook_event', 'file_uploaded')
-        print(f"📡 Webhook Event: {webhook_event}")
+        logger.info("📡 Webhook Event: %s", webhook_event)
         
         # Extract veteran information from webhook
-        veteran_info = extract_veteran_info_from_webhook(webhook_data)
-        print(f"👤 Veteran: {veteran_info['name']} ({veteran_info['email']})")
-        print(f"📄 File: {veteran_info['filename']} ({veteran_info.get('file_size', 'unknown size')})")
+        veteran_info = extract_veteran_info_from_webhook(webhook_data, now)
+        logger.info("👤 Veteran: %s (%s)", veteran_info['name'], veteran_info['email'])
+        logger.info("📄 File: %s (%s)", veteran_info['filename'], veteran_info.get('file_size', 'unknown size'))
+        
+        # A payload without a usable file is rejected before any WorkDrive or Claude call;
+        # otherwise it would be analyzed (and emailed) as the sample records
+        download_url = veteran_info['download_url']
+        if not veteran_info['file_id'] or not (isinstance(download_url, str) and download_url.startswith(('https://', 'http://'))):
+            logger.warning("⚠️ Rejecting webhook without a valid file ID and download URL: %s", veteran_info['filename'])
+            return jsonify({
+                'success': False,
+                'error': 'Webhook payload needs a file id and an http(s) download_url',
+                'timestamp': now.isoformat(),
+                'webhook_received': True
+            }), 400
+        
+        # Background mode: acknowledge now and run every step below as a background task
+        if WEBHOOK_BACKGROUND_MODE:
+            new_job_id = uuid.uuid4().hex
+            job_id = claim_pipeline_job(new_job_id, {
+                'status': 'queued',
+                'file_id': veteran_info['file_id'],
+                'veteran_name': veteran_info['name'],
+                'file_processed': veteran_info['filename'],
+                'queued_at': now.isoformat()
+            })
+            if job_id == new_job_id:
+                app.add_background_task(run_va_pipeline_job, job_id, veteran_info)
+                logger.info("🗂️ Accepted for background processing: job %s", job_id)
+            else:
+                logger.info("♻️ Upload already in progress as job %s", job_id)
+            
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'status': get_job('pipeline_jobs', job_id)['status'],
+                'status_url': f'/batch-status/{job_id}',
+                'veteran_name': veteran_info['name'],
+                'webhook_event': webhook_event,
+                'file_processed': veteran_info['filename'],
+                'ai_backend': 'Claude-3.5-Sonnet',
+                'message': 'Senior Rater analysis accepted for background processing'
+            }), 202
         
         # Step 1: Download medical records from WorkDrive
-        medical_text = download_medical_records_from_workdrive(veteran_info['download_url'])
-        print(f"📥 Downloaded {len(medical_text)} characters of medical records")
+        medical_text = await download_medical_records_from_workdrive(veteran_info['download_url'])
+        logger.info("📥 Downloaded %s characters of medical records", len(medical_text))
         
-        # Step 2: Analyze with Claude in Senior Rater mode
-        analysis_result = analyze_medical_records_with_claude(medical_text, veteran_info)
-        print("🤖 Claude Senior Rater analysis completed")
+        # Keep only the slice Claude sees so the full text can be freed before the slow API call
+        medical_snippet = medical_text[:MEDICAL_TEXT_PROMPT_CHARS]
+        del medical_text
         
-        # Step 3: Generate comprehensive HTML report
-        report_html = generate_comprehensive_html_report(analysis_result, veteran_info, medical_text)
-        print("📊 Comprehensive report generated")
+        # Re-fired webhooks for the same upload reuse the analysis and rendered report
+        report_cache_key = get_report_cache_key(veteran_info['file_id'], medical_snippet)
+        cached_report = get_cached_report(report_cache_key)
         
-        # Step 4: Upload report to WorkDrive
-        report_url = upload_report_to_workdrive(report_html, veteran_info)
-        print(f"🔗 Report uploaded: {report_url}")
+        # Batch mode: queue uncached analyses and let the batch worker finish the pipeline
+        if cached_report is None and CLAUDE_BATCH_MODE and get_cached_analysis(get_analysis_cache_key(medical_snippet)) is None:
+            job_id = uuid.uuid4().hex
+            save_job('claude_batch_jobs', job_id, {
+                'status': 'queued',
+                'veteran_name': veteran_info['name'],
+                'file_processed': veteran_info['filename'],
+                'queued_at': now.isoformat()
+            })
+            await claude_batch_queue.put((job_id, medical_snippet, veteran_info))
+            logger.info("🗂️ Queued for Claude batch analysis: job %s", job_id)
+            
+            return jsonify({
+                'success': True,
+                'job_id': job_id,
+                'status': 'queued',
+                'status_url': f'/batch-status/{job_id}',
+                'veteran_name': veteran_info['name'],
+                'webhook_event': webhook_event,
+                'file_processed': veteran_info['filename'],
+                'ai_backend': 'Claude-3.5-Sonnet (Message Batches)',
+                'message': 'Senior Rater analysis queued for batch processing'
+            }), 202
         
-        # Step 5: Email notification
-        send_notification_email(veteran_info, report_url, analysis_result)
-        print("📧 Email notification sent")
+        if cached_report is not None:
+            logger.info("♻️ Reusing cached report for this upload")
+            analysis_result, report_gz = cached_report
+        else:
+            # Steps 2-3: Analyze with Claude and render the report
+            analysis_result, report_gz = await analyze_and_render_report(medical_snippet, veteran_info, report_cache_key)
         
-        # Step 6: Update CRM
-        update_crm_record(veteran_info, analysis_result, report_url)
-        print("📋 CRM updated")
+        # Steps 4-6: Upload, notify and update CRM
+        report_url = await deliver_va_report(report_gz, analysis_result, veteran_info)
         
         return jsonify({
             'success': True,
             'veteran_name': veteran_info['name'],
             'report_url': report_url,
-            'processing_time': datetime.now().isoformat(),
+            'processing_time': now.isoformat(),
             'webhook_event': webhook_event,
             'file_processed': veteran_info['filename'],
             'ai_backend': 'Claude-3.5-Sonnet',
@@ -570,16 +397,90 @@ def process_va_records():
         })
         
     except Exception as e:
-        print(f"❌ Error processing VA records: {str(e)}")
+        logger.error("❌ Error processing VA records: %s", e)
         return jsonify({
             'success': False,
             'error': str(e),
-            'timestamp': datetime.now().isoformat(),
-            'webhook_received': bool(request.json),
+            'timestamp': now.isoformat(),
+            'webhook_received': bool(webhook_data),
             'ai_backend': 'Claude-3.5-Sonnet'
         }), 500
 
-def extract_veteran_info_from_webhook(webhook_data: Dict) -> Dict[str, Any]:
+async def analyze_and_render_report(medical_snippet: str, veteran_info: Dict, report_cache_key: str) -> tuple:
+    """Run the Senior Rater analysis, render the gzipped report and cache the pair unless it is a fallback"""
+    analysis_result = await analyze_medical_records_with_claude(medical_snippet, veteran_info)
+    logger.info("🤖 Claude Senior Rater analysis completed")
+    
+    report_gz = render_compressed_report(analysis_result, veteran_info)
+    logger.info("📊 Comprehensive report generated")
+    # A fallback report is never cached, so the next delivery of this upload retries Claude
+    if not is_fallback_analysis(analysis_result):
+        cache_report(report_cache_key, analysis_result, report_gz)
+    return analysis_result, report_gz
+
+async def run_va_pipeline_job(job_id: str, veteran_info: Dict) -> None:
+    """Download, analyze and deliver one webhook acknowledged in background mode"""
+    update_job('pipeline_jobs', job_id, status='processing')
+    try:
+        medical_text = await download_medical_records_from_workdrive(veteran_info['download_url'])
+        medical_snippet = medical_text[:MEDICAL_TEXT_PROMPT_CHARS]
+        del medical_text
+        
+        report_cache_key = get_report_cache_key(veteran_info['file_id'], medical_snippet)
+        cached_report = get_cached_report(report_cache_key)
+        if cached_report is not None:
+            logger.info("♻️ Reusing cached report for this upload")
+            analysis_result, report_gz = cached_report
+        else:
+            analysis_result, report_gz = await analyze_and_render_report(medical_snippet, veteran_info, report_cache_key)
+        
+        report_url = await deliver_va_report(report_gz, analysis_result, veteran_info)
+        update_job(
+            'pipeline_jobs', job_id,
+            status='completed',
+            report_url=report_url,
+            completed_at=datetime.now().isoformat()
+        )
+    except Exception as e:
+        logger.error("❌ Error in background job %s: %s", job_id, e)
+        update_job('pipeline_jobs', job_id, status='failed', error=str(e))
+
+async def deliver_va_report(report_gz: bytes, analysis_result: Dict, veteran_info: Dict) -> str:
+    """Upload and announce a rendered report"""
+    # Step 4: Upload report to WorkDrive
+    report_url = await upload_report_to_workdrive(report_gz, veteran_info)
+    logger.info("🔗 Report uploaded: %s", report_url)
+    
+    # Steps 5 & 6: the response only needs the report URL, so the email and CRM
+    # update run after it as a background task (still concurrently with each other)
+    app.add_background_task(announce_va_report, report_url, analysis_result, veteran_info)
+    
+    return report_url
+
+async def announce_va_report(report_url: str, analysis_result: Dict, veteran_info: Dict) -> None:
+    """Send the notification email and update the CRM for an uploaded report"""
+    # Both need the report URL but not each other
+    await asyncio.gather(
+        send_notification_email(veteran_info, report_url, analysis_result),
+        update_crm_record(veteran_info, analysis_result, report_url)
+    )
+    logger.info("📧 Email notification sent")
+    logger.info("📋 CRM updated")
+
+async def read_webhook_payload() -> Optional[Dict[str, Any]]:
+    """Parse the request body as a webhook payload, or None if it is not a JSON object"""
+    try:
+        webhook_data = orjson.loads(await request.get_data())
+    except orjson.JSONDecodeError:
+        return None
+    return webhook_data if isinstance(webhook_data, dict) else None
+
+# Upload filenames look like "John-Doe_john@example.com.pdf"; only a trailing
+# document or scan extension is stripped, and the name part is URL-decoded
+# before dashes become spaces
+FILENAME_EXTENSION_RE = re.compile(r"\.(txt|pdf|docx?|rtf|png|jpe?g)$", re.IGNORECASE)
+
+def extract_veteran_info_from_webhook(webhook_data: Dict, now: datetime) -> Dict[str, Any]:
     """Extract veteran information from Zoho WorkDrive webhook payload"""
     try:
         # Extract key information from webhook
@@ -590,14 +491,14 @@ def extract_veteran_info_from_webhook(webhook_data: Dict) -> Dict[str, Any]:
         file_id = webhook_data.get('id', '')
         file_size = webhook_data.get('storage_info_size', 'unknown')
         file_type = webhook_data.get('type', 'unknown')
-        uploaded_time = webhook_data.get('uploaded_time', datetime.now().strftime('%m/%d/%Y'))
+        uploaded_time = webhook_data.get('uploaded_time') or now.strftime('%m/%d/%Y')
         
         # Extract veteran name from filename or use uploader name
-        name_part = file_name.replace(f'.{file_type}', '').replace('.txt', '').replace('.pdf', '').replace('.doc', '')
+        name_part = FILENAME_EXTENSION_RE.sub('', file_name)
         
         if '_' in name_part:
             parts = name_part.split('_')
-            veteran_name = parts[0].replace('-', ' ').replace('%20', ' ').title()
+            veteran_name = unquote(parts[0]).replace('-', ' ').title()
             veteran_email = parts[1] if len(parts) > 1 and '@' in parts[1] else client_email
         else:
             veteran_name = client_display_name
@@ -614,12 +515,13 @@ def extract_veteran_info_from_webhook(webhook_data: Dict) -> Dict[str, Any]:
             'uploaded_time': uploaded_time,
             'uploader_email': client_email,
             'uploader_name': client_display_name,
-            'date': datetime.now().strftime('%m%d%Y'),
-            'report_id': f"VAR-{datetime.now().strftime('%Y%m%d')}-{file_id[:8]}"
+            'date': now.strftime('%m%d%Y'),
+            'processed_at': now.isoformat(),
+            'report_id': f"VAR-{now.strftime('%Y%m%d')}-{file_id[:8]}"
         }
         
     except Exception as e:
-        print(f"Error extracting veteran info: {e}")
+        logger.error("Error extracting veteran info: %s", e)
         return {
             'name': webhook_data.get('event_by_user_display_name', 'Unknown Veteran'),
             'email': webhook_data.get('event_by_user_email_id', 'unknown@email.com'),
@@ -631,42 +533,74 @@ def extract_veteran_info_from_webhook(webhook_data: Dict) -> Dict[str, Any]:
             'uploaded_time': webhook_data.get('uploaded_time', ''),
             'uploader_email': webhook_data.get('event_by_user_email_id', ''),
             'uploader_name': webhook_data.get('event_by_user_display_name', ''),
-            'date': datetime.now().strftime('%m%d%Y'),
-            'report_id': f"VAR-{datetime.now().strftime('%Y%m%d')}-{datetime.now().strftime('%H%M%S')}"
+            'date': now.strftime('%m%d%Y'),
+            'processed_at': now.isoformat(),
+            'report_id': f"VAR-{now.strftime('%Y%m%d-%H%M%S')}"
         }
 
-def download_medical_records_from_workdrive(download_url: str) -> str:
+def get_zoho_breaker_state() -> str:
+    """Current WorkDrive circuit state: closed, open, or half-open once the cool-down has passed"""
+    if zoho_breaker['opened_at'] is None:
+        return 'closed'
+    if time.monotonic() - zoho_breaker['opened_at'] >= ZOHO_BREAKER_RESET_SECONDS:
+        return 'half-open'
+    return 'open'
+
+def record_zoho_download_outcome(succeeded: bool) -> None:
+    """Track consecutive WorkDrive outages and trip or reset the circuit"""
+    if succeeded:
+        zoho_breaker['failures'] = 0
+        zoho_breaker['opened_at'] = None
+        return
+    
+    zoho_breaker['failures'] += 1
+    # A failed half-open probe re-opens immediately for another cool-down
+    if zoho_breaker['failures'] >= ZOHO_BREAKER_FAIL_MAX or zoho_breaker['opened_at'] is not None:
+        if zoho_breaker['opened_at'] is None:
+            logger.info("⚡ WorkDrive circuit opened after %s consecutive failures", zoho_breaker['failures'])
+        zoho_breaker['opened_at'] = time.monotonic()
+
+async def download_medical_records_from_workdrive(download_url: str) -> str:
     """Download medical records from WorkDrive"""
+    if get_zoho_breaker_state() == 'open':
+        logger.info("⚡ WorkDrive circuit open, using sample records without calling Zoho")
+        return generate_sample_medical_records()
+    
     try:
-        print(f"🔗 Downloading from: {download_url}")
+        logger.info("🔗 Downloading from: %s", download_url)
         
-        headers = {
-            'Authorization': f'Zoho-oauthtoken {ZOHO_ACCESS_TOKEN}',
-            'User-Agent': 'VA-Claims-Analysis-System/3.0'
-        }
+        async with get_zoho_client().stream('GET', download_url) as response:
+            if response.status_code != 200:
+                logger.error("❌ Download failed: %s", response.status_code)
+                # Only server-side errors say Zoho is unhealthy; a 4xx is about this file
+                record_zoho_download_outcome(response.status_code < 500)
+                raise Exception(f"Failed to download file: HTTP {response.status_code}")
+            
+            # Closing the stream early drops the rest of a multi-MB file unread;
+            # small fixed-size chunks keep the buffer from overshooting the cap
+            buffer = bytearray()
+            async for chunk in response.aiter_bytes(chunk_size=MEDICAL_RECORDS_DOWNLOAD_CHUNK):
+                buffer += chunk
+                if len(buffer) >= MEDICAL_RECORDS_DOWNLOAD_LIMIT:
+                    del buffer[MEDICAL_RECORDS_DOWNLOAD_LIMIT:]
+                    break
         
-        response = requests.get(download_url, headers=headers, timeout=30)
+        record_zoho_download_outcome(True)
+        return buffer.decode('utf-8', errors='replace')
         
-        if response.status_code == 200:
-            try:
-                return response.text
-            except UnicodeDecodeError:
-                print("⚠️ Binary file detected, may need OCR processing")
-                return f"Binary file content ({len(response.content)} bytes) - OCR processing needed"
-        else:
-            print(f"❌ Download failed: {response.status_code} - {response.text}")
-            raise Exception(f"Failed to download file: HTTP {response.status_code}")
+    except httpx.TransportError as e:
+        logger.error("❌ Error downloading file: %s", e)
+        record_zoho_download_outcome(False)
+        return generate_sample_medical_records()
         
     except Exception as e:
-        print(f"❌ Error downloading file: {e}")
+        logger.error("❌ Error downloading file: %s", e)
         # Return sample medical records for testing/fallback
         return generate_sample_medical_records()
 
-def generate_sample_medical_records() -> str:
-    """Generate sample medical records for testing"""
-    return f"""
+SAMPLE_MEDICAL_RECORDS_TEMPLATE = """
 DEPARTMENT OF VETERANS AFFAIRS MEDICAL RECORD
-Generated: {datetime.now().strftime('%B %d, %Y')}
+Generated: {generated}
 
 PATIENT: Sample Veteran
 DOB: January 1, 1970
@@ -703,328 +637,18 @@ PROVIDER ASSESSMENTS:
 - "Depression appears to be secondary to PTSD"
 """
 
-def analyze_medical_records(medical_text, veteran_info):
-    """Analyze medical records using OpenAI with Senior Rater prompt"""
-    try:
-        openai.api_key = OPENAI_API_KEY
-        
-        # Enhanced Senior VA Claims Rater analysis prompt
-        analysis_prompt = f"""
-SYSTEM INSTRUCTIONS - "VA Senior Rater Mode"
-
-1. Identity and Authority
-You are "Senior VA Claims Rater – GS-13." Assume full mastery of 38 CFR Part 4 (Schedule for Rating Disabilities), M21-1 adjudication manual, and all recent VBA policy letters. Your core mission is to review the Veteran's submissions and present the highest supportable ratings plus any additional benefits or special monthly compensation the facts may allow.
-
-2. Core Objectives
-a. Parse every piece of evidence or letter provided.
-b. Map each finding to the correct diagnostic code, severity tier, and compensable percentage under 38 CFR.
-c. When uncertainty exists, choose the interpretation that yields the greater benefit, per the "benefit-of-the-doubt" and "maximization" doctrines.
-d. Output:
- • A ratings table (condition, code, % sought, % likely, CFR cites).
- • A narrative explaining why each rating is supportable.
- • A "missing evidence" checklist showing exactly what is still needed to reach or secure the next higher level.
- • Recommended timing or sequencing of claims if that can improve combined evaluation math (avoid the VA's "pyramiding" rule conflicts).
-
-3. Evidence Weighting Rules
-– In-service medical records and VA C&P exams carry the greatest probative weight.
-– Private nexus opinions from MD or NP are probative if they include (1) medical rationale, (2) references to records, and (3) ≥ 50 percent "at least as likely as not" language.
-– Lay statements can corroborate chronicity and severity when medical evidence is absent or ambiguous.
-– Never discount obesity as an "intermediate step" link for secondary service connection. Cite VAOPGCPREC 1-2017 where relevant.
-
-4. Rating Math
-Apply the VA combined rating table exactly. Always check whether individual ratings drive the Veteran over 95 percent before rounding, trigger P&T potential, or create eligibility for SMC-S or SMC-(L through O).
-
-5. Style and Tone
-– Write short, plain-English sentences suited to a non-lawyer Veteran audience.
-– Cite 38 CFR sections and diagnostic codes in parentheses after each conclusion.
-– Never hedge with phrases like "might" or "possibly" unless absolutely necessary.
-– Avoid legal boilerplate that does not aid the Veteran.
-– Do not use em dashes.
-
-6. Bias Check
-Before final output, scan for unintended bias, correct it, and ensure recommendations reflect the Veteran's best interest.
-
-7. Limitations
-If the evidence is truly insufficient, state so, but always suggest the exact document, test, or wording needed to cure the defect.
-
-8. Safety and Compliance
-Do not offer medical or legal advice. Only interpret evidence for rating purposes.
-
-VETERAN INFORMATION:
-- Name: {veteran_info['name']}
-- File: {veteran_info['filename']} ({veteran_info['file_size']})
-- Upload Date: {veteran_info['uploaded_time']}
-
-MEDICAL RECORDS:
-{medical_text[:6000]}
-
-Please provide your analysis in this EXACT JSON format:
-{{
-    "current_conditions": [
-        {{
-            "name": "Condition Name",
-            "current_rating": 50,
-            "diagnostic_code": "9411",
-            "potential_rating": 70,
-            "evidence": "Key evidence supporting this condition",
-            "cfr_citation": "38 CFR 4.130",
-            "probability": "High",
-            "missing_evidence": ["Specific evidence needed"],
-            "action_required": "Specific steps to take",
-            "timeline": "Expected timeframe"
-        }}
-    ],
-    "new_opportunities": [
-        {{
-            "condition": "New Condition Name",
-            "connection_type": "Secondary to existing condition",
-            "potential_rating": 30,
-            "diagnostic_code": "6260",
-            "evidence": "Supporting evidence found",
-            "cfr_citation": "38 CFR citation",
-            "action_required": "Specific action to take",
-            "success_probability": "High/Medium/Low"
-        }}
-    ],
-    "combined_rating": {{
-        "current": 70,
-        "potential": 90,
-        "current_monthly": 1663,
-        "potential_monthly": 2200,
-        "calculation_method": "Step by step calculation"
-    }},
-    "strategic_plan": [
-        {{
-            "priority": "High",
-            "title": "Action Item Title",
-            "description": "What needs to be done",
-            "timeline": "30 days",
-            "impact": "Expected outcome",
-            "cfr_basis": "Regulatory foundation"
-        }}
-    ],
-    "evidence_gaps": [
-        "Specific evidence gap 1",
-        "Specific evidence gap 2"
-    ],
-    "special_monthly_compensation": {{
-        "eligible": false,
-        "type": "SMC-S or other",
-        "additional_monthly": 0,
-        "requirements": "What would be needed"
-    }},
-    "pyramiding_analysis": {{
-        "potential_issues": ["Issue 1"],
-        "recommendations": ["Recommendation 1"]
-    }}
-}}
-
-Focus on maximizing benefits using the benefit-of-the-doubt doctrine. Include specific CFR citations and actionable recommendations.
-"""
+def generate_sample_medical_records() -> str:
+    """Generate sample medical records for testing"""
+    return SAMPLE_MEDICAL_RECORDS_TEMPLATE.format(generated=datetime.now().strftime('%B %d, %Y'))
 
-        response = openai.ChatCompletion.create(
-            model="gpt-4",
-            messages=[
-                {
-                    "role": "system", 
-                    "content": "You are a Senior VA Claims Rater (GS-13) with complete mastery of 38 CFR Part 4 and M21-1 manual. Always respond with valid JSON only. Apply benefit-of-the-doubt and maximization principles throughout your analysis."
-                },
-                {
-                    "role": "user", 
-                    "content": analysis_prompt
-                }
-            ],
-            max_tokens=4000,
-            temperature=0.1
-        )
-        
-        # Parse JSON response
-        analysis_json = response.choices[0].message.content
-        
-        # Clean up JSON if needed
-        if '```json' in analysis_json:
-            analysis_json = analysis_json.split('```json')[1].split('```')[0]
-        elif '```' in analysis_json:
-            analysis_json = analysis_json.split('```')[1].split('```')[0]
-        
-        return json.loads(analysis_json.strip())
-        
-    except json.JSONDecodeError as e:
-        print(f"❌ JSON parsing error: {e}")
-        print(f"Raw response: {analysis_json}")
-        # Return enhanced sample analysis
-        return get_enhanced_sample_analysis(veteran_info)
-        
-    except Exception as e:
-        print(f"❌ Error in AI analysis: {e}")
-        return get_enhanced_sample_analysis(veteran_info)
+# Static Senior Rater instructions and output schema, built once at import. Sent as
+# an ephemeral-cached system block so Anthropic only re-tokenizes the veteran tail
+SENIOR_RATER_PROMPT_HEAD = """You are a Senior VA Claims Rater (GS-13) with complete mastery of 38 CFR Part 4 and M21-1 manual. Always respond with valid JSON only. Apply benefit-of-the-doubt and maximization principles.
 
-def get_enhanced_sample_analysis(veteran_info):
-    """Return enhanced sample analysis for testing/fallback with Senior Rater approach"""
-    return {
-        "current_conditions": [
-            {
-                "name": "PTSD",
-                "current_rating": 50,
-                "diagnostic_code": "9411",
-                "potential_rating": 70,
-                "evidence": "Sleep disturbances, social isolation, panic attacks, and occupational impairment documented in medical records",
-                "cfr_citation": "38 CFR 4.130",
-                "probability": "High",
-                "missing_evidence": [
-                    "Updated mental health evaluation specifically addressing occupational impact",
-                    "Detailed functional capacity assessment",
-                    "Employment records showing work difficulties"
-                ],
-                "action_required": "Request comprehensive C&P exam focusing on occupational and social impairment criteria for 70% rating",
-                "timeline": "60-90 days for C&P scheduling"
-            },
-            {
-                "name": "Tinnitus",
-                "current_rating": 10,
-                "diagnostic_code": "6260",
-                "potential_rating": 10,
-                "evidence": "Bilateral tinnitus documented, rating at maximum allowable under current CFR",
-                "cfr_citation": "38 CFR 4.87",
-                "probability": "Stable",
-                "missing_evidence": ["No additional evidence can increase this rating"],
-                "action_required": "Maintain current rating, no action needed",
-                "timeline": "N/A"
-            },
-            {
-                "name": "Lumbar Spine Condition",
-                "current_rating": 20,
-                "diagnostic_code": "5243",
-                "potential_rating": 40,
-                "evidence": "Range of motion limitations and pain documented, may qualify for higher rating based on functional loss",
-                "cfr_citation": "38 CFR 4.71a",
-                "probability": "Medium",
-                "missing_evidence": [
-                    "Recent range of motion measurements",
-                    "X-rays or MRI showing progression",
-                    "Functional impact documentation"
-                ],
-                "action_required": "Schedule orthopedic C&P exam with specific ROM measurements and functional assessment",
-                "timeline": "30-60 days"
-            }
-        ],
-        "new_opportunities": [
-            {
-                "condition": "Sleep Apnea",
-                "connection_type": "Secondary to PTSD",
-                "potential_rating": 50,
-                "diagnostic_code": "6847",
-                "evidence": "Sleep disturbances and breathing issues noted in records, strong secondary connection to PTSD",
-                "cfr_citation": "38 CFR 4.97",
-                "action_required": "Order sleep study and obtain nexus letter from psychiatrist linking sleep apnea to PTSD",
-                "success_probability": "High"
-            },
-            {
-                "condition": "Depression",
-                "connection_type": "Secondary to PTSD",
-                "potential_rating": 30,
-                "diagnostic_code": "9434",
-                "evidence": "Depression symptoms documented, medications prescribed, clear connection to existing PTSD",
-                "cfr_citation": "38 CFR 4.130",
-                "action_required": "File secondary claim with nexus opinion from mental health provider",
-                "success_probability": "High"
-            },
-            {
-                "condition": "Hypertension",
-                "connection_type": "Secondary to PTSD and/or medication side effects",
-                "potential_rating": 20,
-                "diagnostic_code": "7101",
-                "evidence": "Blood pressure elevation documented, potential connection to PTSD medication side effects",
-                "cfr_citation": "38 CFR 4.104",
-                "action_required": "Obtain medical opinion linking hypertension to service-connected conditions or medications",
-                "success_probability": "Medium"
-            }
-        ],
-        "combined_rating": {
-            "current": 60,
-            "potential": 100,
-            "current_monthly": 1361,
-            "potential_monthly": 3737,
-            "calculation_method": "Current: 50% + 20% + 10% = 64% rounded to 60%. Potential: 70% + 50% + 40% + 30% + 20% = 95.68% rounded to 100%"
-        },
-        "strategic_plan": [
-            {
-                "priority": "High",
-                "title": "File Sleep Apnea Secondary Claim Immediately",
-                "description": "Strong evidence supports secondary connection to PTSD. Sleep study plus nexus letter should secure 50% rating",
-                "timeline": "30-60 days to gather evidence, file within 90 days",
-                "impact": "Potential 50% rating = significant monthly increase",
-                "cfr_basis": "38 CFR 4.97 - Sleep Apnea Rating Schedule"
-            },
-            {
-                "priority": "High", 
-                "title": "Request PTSD Rating Increase",
-                "description": "Current evidence supports 70% rating based on occupational impairment criteria",
-                "timeline": "60-90 days for C&P exam process",
-                "impact": "20% increase = approximately $400+/month increase",
-                "cfr_basis": "38 CFR 4.130 - Mental Disorders Rating Schedule"
-            },
-            {
-                "priority": "Medium",
-                "title": "Pursue Lumbar Spine Increase",
-                "description": "Updated range of motion measurements may support higher rating",
-                "timeline": "30-60 days for orthopedic evaluation",
-                "impact": "Potential increase from 20% to 40%",
-                "cfr_basis": "38 CFR 4.71a - Musculoskeletal System"
-            },
-            {
-                "priority": "Medium",
-                "title": "File Depression Secondary Claim",
-                "description": "Clear secondary connection to PTSD with supporting medical evidence",
-                "timeline": "Concurrent with PTSD increase claim",
-                "impact": "Additional 30% rating potential",
-                "cfr_basis": "38 CFR 4.130 - Mental Disorders Rating Schedule"
-            }
-        ],
-        "evidence_gaps": [
-            "Current sleep study results needed for sleep apnea claim",
-            "Updated mental health evaluation focusing on occupational impacts for PTSD increase",
-            "Recent lumbar spine range of motion measurements and imaging",
-            "Nexus letters from treating physicians for secondary conditions",
-            "Employment records documenting work-related difficulties",
-            "Functional impact statements from family members",
-            "Medication side effect documentation for potential hypertension claim"
-        ],
-        "special_monthly_compensation": {
-            "eligible": True,
-            "type": "SMC-S (Special Monthly Compensation)",
-            "additional_monthly": 400,
-            "requirements": "If combined rating reaches 100%, veteran may be eligible for SMC-S for unemployability or specific loss of use"
-        },
-        "pyramiding_analysis": {
-            "potential_issues": [
-                "Ensure PTSD and Depression ratings don't pyramid if based on same symptoms",
-                "Verify sleep apnea rating is truly secondary and not duplicate symptom"
-            ],
-            "recommendations": [
-                "File depression as separate secondary claim with distinct symptom set",
-                "Ensure sleep apnea nexus clearly establishes separate pathophysiology",
-                "Consider TDIU if individual ratings don't reach 100% but veteran is unemployable"
-            ]
-        }
-    }
-    """Analyze medical records using Claude in Senior VA Rater mode"""
-    try:
-        # Construct the comprehensive senior rater prompt
-        analysis_prompt = f"""
 SYSTEM INSTRUCTIONS - "VA Senior Rater Mode"
 
 You are "Senior VA Claims Rater – GS-13." Assume full mastery of 38 CFR Part 4 (Schedule for Rating Disabilities), M21-1 adjudication manual, and all recent VBA policy letters. Your core mission is to review the Veteran's submissions and present the highest supportable ratings plus any additional benefits or special monthly compensation the facts may allow.
 
-VETERAN INFORMATION:
-- Name: {veteran_info['name']}
-- File: {veteran_info['filename']} ({veteran_info['file_size']})
-- Upload Date: {veteran_info['uploaded_time']}
-- Report ID: {veteran_info['report_id']}
-
-MEDICAL RECORDS TO ANALYZE:
-{medical_text[:8000]}
-
 ANALYSIS REQUIREMENTS:
 1. Parse every piece of evidence provided
 2. Map each finding to correct diagnostic code, severity tier, and compensable percentage under 38 CFR
@@ -1032,8 +656,12 @@ ANALYSIS REQUIREMENTS:
 4. Apply maximization principles throughout analysis
 
 OUTPUT REQUIRED AS VALID JSON:
-{{
-    "executive_summary": {{
+"""
+
+# Example analysis Claude must mirror; kept as a dict so the schema stays
+# authoritative in Python and is serialized once at import
+ANALYSIS_SCHEMA_EXAMPLE = {
+    "executive_summary": {
         "current_combined_rating": 0,
         "potential_combined_rating": 0,
         "current_monthly_compensation": 0,
@@ -1043,9 +671,9 @@ OUTPUT REQUIRED AS VALID JSON:
         "total_conditions_analyzed": 0,
         "high_priority_opportunities": 3,
         "key_findings": ["Finding 1", "Finding 2", "Finding 3"]
-    }},
+    },
     "current_service_connected_conditions": [
-        {{
+        {
             "condition_name": "Condition Name",
             "current_rating": 50,
             "diagnostic_code": "9411",
@@ -1057,10 +685,10 @@ OUTPUT REQUIRED AS VALID JSON:
             "probability_increase": "High/Moderate/Low",
             "action_required": "Specific steps needed",
             "timeline": "30-60 days"
-        }}
+        }
     ],
     "missed_claiming_opportunities": [
-        {{
+        {
             "condition_name": "New Condition Name",
             "connection_type": "Direct/Secondary/Aggravation",
             "primary_condition": "If secondary, what condition causes this",
@@ -1072,92 +700,95 @@ OUTPUT REQUIRED AS VALID JSON:
             "recommended_strategy": "Specific claiming approach",
             "evidence_needed": "Additional evidence required",
             "success_probability": "High/Moderate/Low"
-        }}
+        }
     ],
-    "combined_rating_scenarios": {{
-        "current_calculation": {{
+    "combined_rating_scenarios": {
+        "current_calculation": {
             "individual_ratings": [50, 30, 10],
             "combined_rating": 70,
             "monthly_compensation": 1716
-        }},
-        "conservative_scenario": {{
+        },
+        "conservative_scenario": {
             "individual_ratings": [70, 30, 10],
             "combined_rating": 80,
             "monthly_compensation": 1995
-        }},
-        "realistic_scenario": {{
+        },
+        "realistic_scenario": {
             "individual_ratings": [70, 50, 30],
             "combined_rating": 90,
             "monthly_compensation": 2241
-        }},
-        "optimistic_scenario": {{
+        },
+        "optimistic_scenario": {
             "individual_ratings": [100, 50, 30],
             "combined_rating": 100,
             "monthly_compensation": 3737
-        }},
+        },
         "tdiu_potential": "Yes/No with explanation"
-    }},
-    "special_monthly_compensation": {{
+    },
+    "special_monthly_compensation": {
         "eligible": "Yes/No",
         "type": "SMC-S, SMC-L, etc.",
         "additional_monthly": 0,
         "requirements_met": "Specific SMC requirements analysis"
-    }},
-    "strategic_action_plan": {{
+    },
+    "strategic_action_plan": {
         "immediate_actions": [
-            {{
+            {
                 "priority": "High/Medium/Low",
                 "action": "Specific action to take",
                 "deadline": "Specific deadline if applicable",
                 "impact": "Expected outcome",
                 "cost_benefit": "Effort vs reward analysis"
-            }}
+            }
         ],
         "short_term_actions": [
-            {{
+            {
                 "priority": "High/Medium/Low",
                 "action": "Specific action to take",
                 "timeline": "30-90 days",
                 "impact": "Expected outcome",
                 "resources_needed": "What is required"
-            }}
+            }
         ],
         "long_term_actions": [
-            {{
+            {
                 "priority": "High/Medium/Low",
                 "action": "Specific action to take",
                 "timeline": "90+ days",
                 "impact": "Expected outcome",
                 "monitoring_required": "What to track"
-            }}
+            }
         ]
-    }},
-    "evidence_gaps_analysis": {{
+    },
+    "evidence_gaps_analysis": {
         "critical_missing_evidence": ["Missing item 1", "Missing item 2"],
         "medical_opinions_needed": ["Opinion type 1", "Opinion type 2"],
         "lay_statements_recommended": ["Topic 1", "Topic 2"],
         "additional_testing_suggested": ["Test type 1", "Test type 2"],
         "contradictory_evidence": ["Issue 1", "Issue 2"],
         "evidence_development_priority": "Ranked list of evidence to gather"
-    }},
-    "pyramiding_considerations": {{
+    },
+    "pyramiding_considerations": {
         "potential_issues": ["Issue 1", "Issue 2"],
         "recommended_strategies": ["Strategy 1", "Strategy 2"],
         "bilateral_factor_applicable": "Yes/No with conditions"
-    }},
-    "appeal_opportunities": {{
+    },
+    "appeal_opportunities": {
         "decisions_to_appeal": ["Decision 1", "Decision 2"],
         "appeal_deadlines": ["Date 1", "Date 2"],
         "appeal_strategies": ["Strategy 1", "Strategy 2"],
         "success_probability": "Assessment of appeal chances"
-    }},
-    "document_preparation_guidance": {{
+    },
+    "document_preparation_guidance": {
         "lay_statement_topics": ["Topic 1", "Topic 2"],
         "medical_opinion_requirements": ["Requirement 1", "Requirement 2"],
         "evidence_organization": "How to present evidence",
         "c_and_p_exam_preparation": "Preparation recommendations"
-    }}
-}}
+    }
+}
+ANALYSIS_SCHEMA_JSON = orjson.dumps(ANALYSIS_SCHEMA_EXAMPLE, option=orjson.OPT_INDENT_2).decode()
+
+SENIOR_RATER_PROMPT_TAIL = """
 
 CRITICAL REQUIREMENTS:
 - Apply benefit-of-the-doubt doctrine throughout
@@ -1169,47 +800,311 @@ CRITICAL REQUIREMENTS:
 - Address contradictory evidence strategically
 - Consider all secondary service connection opportunities
 - Analyze TDIU potential if individual ratings don't reach 100%
-
-Provide comprehensive Senior Rater analysis focusing on maximizing veteran benefits.
 """
 
-        # Make API call to Claude
-        message = anthropic_client.messages.create(
-            model=CLAUDE_MODEL,
-            max_tokens=4000,
-            temperature=0.1,
-            system="You are a Senior VA Claims Rater (GS-13) with complete mastery of 38 CFR Part 4 and M21-1 manual. Always respond with valid JSON only. Apply benefit-of-the-doubt and maximization principles.",
-            messages=[
-                {
-                    "role": "user",
-                    "content": analysis_prompt
-                }
-            ]
+SENIOR_RATER_SYSTEM_PROMPT = SENIOR_RATER_PROMPT_HEAD + ANALYSIS_SCHEMA_JSON + SENIOR_RATER_PROMPT_TAIL
+
+SENIOR_RATER_SYSTEM_BLOCKS = [
+    {
+        "type": "text",
+        "text": SENIOR_RATER_SYSTEM_PROMPT,
+        "cache_control": {"type": "ephemeral"}
+    }
+]
+
+ANALYSIS_VETERAN_PROMPT_TEMPLATE = """VETERAN INFORMATION:
+- Name: {name}
+- File: {filename} ({file_size})
+- Upload Date: {uploaded_time}
+- Report ID: {report_id}"""
+
+ANALYSIS_PROMPT_CLOSING = "Provide comprehensive Senior Rater analysis focusing on maximizing veteran benefits."
+
+# Claude's turn is prefilled with the opening brace, so it answers with bare JSON:
+# no markdown fence or preamble to strip and no tokens spent generating them
+ANALYSIS_JSON_PREFILL = "{"
+ANALYSIS_MAX_TOKENS = 4000
+
+def get_analysis_cache_key(medical_text: str) -> str:
+    """Build the analysis cache key from the medical text and the Claude model"""
+    # Whitespace is normalized first so a re-exported copy of the same records still hits
+    normalized_text = ' '.join(medical_text.split())
+    digest = hashlib.sha256(normalized_text.encode('utf-8')).hexdigest()
+    return f"vaclaim:{digest}:{CLAUDE_MODEL}"
+
+@functools.cache
+def get_shared_db() -> Optional[sqlite3.Connection]:
+    """
+    Connection to the on-disk analysis cache and job registry, or None when ANALYSIS_CACHE_DB is unset.
+    Opened lazily so each forked worker gets its own connection.
+    """
+    if not ANALYSIS_CACHE_DB:
+        return None
+    
+    db = sqlite3.connect(
+        ANALYSIS_CACHE_DB, timeout=SHARED_DB_BUSY_TIMEOUT_SECONDS, isolation_level=None, check_same_thread=False
+    )
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute(
+        "CREATE TABLE IF NOT EXISTS analysis_cache "
+        "(cache_key TEXT PRIMARY KEY, analysis_json TEXT NOT NULL, cached_at REAL NOT NULL)"
+    )
+    db.execute("DELETE FROM analysis_cache WHERE cached_at < ?", (time.time() - ANALYSIS_CACHE_TTL_SECONDS,))
+    for registry in job_registries:
+        db.execute(
+            f"CREATE TABLE IF NOT EXISTS {registry} "
+            "(job_id TEXT PRIMARY KEY, job_json TEXT NOT NULL, updated_at REAL NOT NULL)"
         )
-        
+        db.execute(f"CREATE INDEX IF NOT EXISTS {registry}_updated_at ON {registry} (updated_at)")
+    return db
+
+def get_cached_analysis(cache_key: str) -> Optional[str]:
+    """Return the cached analysis JSON for a key, or None if missing or expired"""
+    entry = analysis_cache.get(cache_key)
+    if entry is None:
+        entry = load_persisted_analysis(cache_key)
+        if entry is None:
+            return None
+        analysis_cache[cache_key] = entry
+    
+    cached_at, analysis_json = entry
+    if time.time() - cached_at > ANALYSIS_CACHE_TTL_SECONDS:
+        del analysis_cache[cache_key]
+        return None
+    
+    analysis_cache.move_to_end(cache_key)
+    while len(analysis_cache) > ANALYSIS_CACHE_MAX_ENTRIES:
+        analysis_cache.popitem(last=False)
+    return analysis_json
+
+def load_persisted_analysis(cache_key: str) -> Optional[tuple]:
+    """Read a (cached_at, analysis JSON) entry from the on-disk cache, if enabled"""
+    try:
+        db = get_shared_db()
+        if db is None:
+            return None
+        row = db.execute(
+            "SELECT cached_at, analysis_json FROM analysis_cache WHERE cache_key = ?", (cache_key,)
+        ).fetchone()
+    except sqlite3.Error as e:
+        logger.warning("⚠️ Analysis cache database unavailable: %s", e)
+        return None
+    
+    return tuple(row) if row else None
+
+def cache_analysis(cache_key: str, analysis_json: str) -> None:
+    """Store Claude's analysis JSON, evicting the least recently used entries"""
+    cached_at = time.time()
+    analysis_cache[cache_key] = (cached_at, analysis_json)
+    analysis_cache.move_to_end(cache_key)
+    while len(analysis_cache) > ANALYSIS_CACHE_MAX_ENTRIES:
+        analysis_cache.popitem(last=False)
+    
+    try:
+        db = get_shared_db()
+        if db is not None:
+            db.execute(
+                "INSERT OR REPLACE INTO analysis_cache (cache_key, analysis_json, cached_at) VALUES (?, ?, ?)",
+                (cache_key, analysis_json, cached_at)
+            )
+    except sqlite3.Error as e:
+        logger.warning("⚠️ Analysis cache database unavailable: %s", e)
+
+def get_report_cache_key(file_id: str, medical_text: str) -> str:
+    """Build the report cache key from the WorkDrive file ID and the medical text"""
+    digest = hashlib.sha256(medical_text.encode('utf-8')).hexdigest()
+    return f"vareport:{file_id}:{digest}"
+
+def get_served_report_cache_key(report_id: str) -> str:
+    """Build the report cache key for a report served directly from /reports/<report_id>"""
+    return f"vareportid:{report_id}"
+
+def get_cached_report(cache_key: str) -> Optional[tuple]:
+    """Return the cached (analysis, gzipped report) pair, refreshing its sliding expiry"""
+    entry = report_cache.get(cache_key)
+    if entry is None:
+        return None
+    
+    last_used, analysis_result, report_gz = entry
+    if time.time() - last_used > REPORT_CACHE_TTL_SECONDS:
+        del report_cache[cache_key]
+        return None
+    
+    report_cache[cache_key] = (time.time(), analysis_result, report_gz)
+    report_cache.move_to_end(cache_key)
+    return analysis_result, report_gz
+
+def cache_report(cache_key: str, analysis_result: Dict, report_gz: bytes) -> None:
+    """Store a finished analysis and its rendered report, evicting the least recently used entries"""
+    report_cache[cache_key] = (time.time(), analysis_result, report_gz)
+    report_cache.move_to_end(cache_key)
+    while len(report_cache) > REPORT_CACHE_MAX_ENTRIES:
+        report_cache.popitem(last=False)
+
+def write_job_row(db: sqlite3.Connection, registry: str, job_id: str, job: Dict[str, Any]) -> None:
+    """Store a job in the shared database, dropping jobs idle past the TTL"""
+    updated_at = time.time()
+    db.execute(
+        f"INSERT OR REPLACE INTO {registry} (job_id, job_json, updated_at) VALUES (?, ?, ?)",
+        (job_id, orjson.dumps(job).decode(), updated_at)
+    )
+    db.execute(f"DELETE FROM {registry} WHERE updated_at < ?", (updated_at - JOB_STATUS_TTL_SECONDS,))
+
+def save_job(registry: str, job_id: str, job: Dict[str, Any]) -> None:
+    """Record a job's current state, in this worker's memory if the shared database is unavailable"""
+    try:
+        db = get_shared_db()
+        if db is not None:
+            write_job_row(db, registry, job_id, job)
+            return
+    except sqlite3.Error as e:
+        logger.warning("⚠️ Job registry database unavailable, keeping job %s in memory: %s", job_id, e)
+    
+    remember_job(registry, job_id, job)
+
+def remember_job(registry: str, job_id: str, job: Dict[str, Any]) -> None:
+    """Store a job in this worker's memory, evicting jobs idle past the TTL"""
+    updated_at = time.time()
+    jobs = job_registries[registry]
+    jobs[job_id] = (updated_at, job)
+    jobs.move_to_end(job_id)
+    # Least recently updated first, so expired jobs are always at the front
+    while jobs and (len(jobs) > JOB_STATUS_MAX_ENTRIES or updated_at - next(iter(jobs.values()))[0] > JOB_STATUS_TTL_SECONDS):
+        jobs.popitem(last=False)
+
+def get_job(registry: str, job_id: str) -> Optional[Dict[str, Any]]:
+    """Return a job's last recorded state, or None if unknown or expired"""
+    expires_before = time.time() - JOB_STATUS_TTL_SECONDS
+    try:
+        db = get_shared_db()
+        if db is not None:
+            row = db.execute(
+                f"SELECT job_json FROM {registry} WHERE job_id = ? AND updated_at >= ?", (job_id, expires_before)
+            ).fetchone()
+            if row:
+                return orjson.loads(row[0])
+    except sqlite3.Error as e:
+        logger.warning("⚠️ Job registry database unavailable: %s", e)
+    
+    # Jobs saved while the database was unavailable (or without one) are kept in memory
+    entry = job_registries[registry].get(job_id)
+    if entry is None or entry[0] < expires_before:
+        return None
+    return entry[1]
+
+def update_job(registry: str, job_id: str, **changes: Any) -> None:
+    """Merge status changes into a recorded job"""
+    job = get_job(registry, job_id)
+    if job is not None:
+        save_job(registry, job_id, {**job, **changes})
+
+def claim_pipeline_job(job_id: str, job: Dict[str, Any]) -> str:
+    """Record a background job for an upload, or return the ID of the job already processing it"""
+    stale_before = time.time() - PIPELINE_JOB_STALE_SECONDS
+    try:
+        db = get_shared_db()
+        if db is not None:
+            # Holding the write lock makes the check and insert atomic across workers
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                row = db.execute(
+                    "SELECT job_id FROM pipeline_jobs WHERE updated_at >= ? "
+                    "AND json_extract(job_json, '$.file_id') = ? AND json_extract(job_json, '$.status') IN (?, ?)",
+                    (stale_before, job['file_id'], *PIPELINE_JOB_IN_FLIGHT_STATUSES)
+                ).fetchone()
+                if row is None:
+                    write_job_row(db, 'pipeline_jobs', job_id, job)
+                db.execute("COMMIT")
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+            return job_id if row is None else row[0]
+    except sqlite3.Error as e:
+        logger.warning("⚠️ Job registry database unavailable, claiming job %s in memory: %s", job_id, e)
+    
+    # Most recently updated first, stopping at the first stale job
+    for existing_id, (updated_at, existing) in reversed(job_registries['pipeline_jobs'].items()):
+        if updated_at < stale_before:
+            break
+        if existing['file_id'] == job['file_id'] and existing['status'] in PIPELINE_JOB_IN_FLIGHT_STATUSES:
+            return existing_id
+    remember_job('pipeline_jobs', job_id, job)
+    return job_id
+
+def build_senior_rater_request(medical_text: str, veteran_info: Dict) -> Dict[str, Any]:
+    """Build the Messages API parameters for a Senior Rater analysis"""
+    # Only the veteran-specific tail is built per call; the static
+    # instructions and schema live in the cached system block
+    veteran_block = ANALYSIS_VETERAN_PROMPT_TEMPLATE.format(
+        name=veteran_info['name'],
+        filename=veteran_info['filename'],
+        file_size=veteran_info['file_size'],
+        uploaded_time=veteran_info['uploaded_time'],
+        report_id=veteran_info['report_id']
+    )
+    records_block = f"MEDICAL RECORDS TO ANALYZE:\n{medical_text[:MEDICAL_TEXT_PROMPT_CHARS]}\n\n{ANALYSIS_PROMPT_CLOSING}"
+    
+    return {
+        "model": CLAUDE_MODEL,
+        "max_tokens": ANALYSIS_MAX_TOKENS,
+        "temperature": 0.1,
+        "system": SENIOR_RATER_SYSTEM_BLOCKS,
+        "messages": [
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": veteran_block},
+                    {"type": "text", "text": records_block}
+                ]
+            },
+            {"role": "assistant", "content": ANALYSIS_JSON_PREFILL}
+        ]
+    }
+
+def extract_analysis_json(response_text: str) -> str:
+    """Rebuild the JSON document from Claude's prefilled continuation"""
+    # Anything after the closing brace (a stray remark) is dropped
+    analysis_json = ANALYSIS_JSON_PREFILL + response_text
+    return analysis_json[:analysis_json.rfind('}') + 1]
+
+async def stream_claude_response(request_params: Dict[str, Any]) -> str:
+    """Stream a Claude completion; the client retries rate-limited and overloaded calls"""
+    # Stream the response so tokens are consumed as they arrive instead
+    # of one long read that waits on the full completion
+    async with claude_semaphore:
+        async with get_anthropic_client().messages.stream(**request_params) as stream:
+            return "".join([text async for text in stream.text_stream])
+
+async def analyze_medical_records_with_claude(medical_text: str, veteran_info: Dict) -> Dict[str, Any]:
+    """Analyze medical records using Claude in Senior VA Rater mode"""
+    # Identical records (webhook retries, re-uploads) reuse the earlier Claude output
+    cache_key = get_analysis_cache_key(medical_text)
+    cached_json = get_cached_analysis(cache_key)
+    if cached_json is not None:
+        logger.info("♻️ Reusing cached Claude analysis for identical medical records")
+        return validate_and_enrich_analysis(orjson.loads(cached_json), veteran_info)
+    
+    try:
+        response_text = await stream_claude_response(build_senior_rater_request(medical_text, veteran_info))
+
         # Parse Claude's response
-        response_text = message.content[0].text
-        
-        # Clean up JSON if needed
-        if '```json' in response_text:
-            response_text = response_text.split('```json')[1].split('```')[0]
-        elif '```' in response_text:
-            response_text = response_text.split('```')[1].split('```')[0]
+        response_text = extract_analysis_json(response_text)
         
-        analysis_result = json.loads(response_text.strip())
+        analysis_result = orjson.loads(response_text)
+        cache_analysis(cache_key, response_text)
         
         # Validate and enrich the analysis
         analysis_result = validate_and_enrich_analysis(analysis_result, veteran_info)
         
         return analysis_result
         
-    except json.JSONDecodeError as e:
-        print(f"❌ JSON parsing error: {e}")
-        print(f"Raw response: {response_text[:500]}...")
+    except orjson.JSONDecodeError as e:
+        logger.error("❌ JSON parsing error: %s", e)
+        logger.error("Raw response: %s...", response_text[:500])
         return generate_fallback_analysis(veteran_info)
         
     except Exception as e:
-        print(f"❌ Error in Claude analysis: {e}")
+        logger.error("❌ Error in Claude analysis: %s", e)
         return generate_fallback_analysis(veteran_info)
 
 def validate_and_enrich_analysis(analysis: Dict, veteran_info: Dict) -> Dict[str, Any]:
@@ -1239,19 +1134,22 @@ def validate_and_enrich_analysis(analysis: Dict, veteran_info: Dict) -> Dict[str
         if 'executive_summary' in analysis:
             current_rating = analysis['combined_rating_scenarios'].get('current_calculation', {}).get('combined_rating', 0)
             potential_rating = analysis['combined_rating_scenarios'].get('realistic_scenario', {}).get('combined_rating', 0)
-            
+            current_monthly = VA_COMPENSATION_RATES.get(current_rating, 0)
+            potential_monthly = VA_COMPENSATION_RATES.get(potential_rating, 0)
+            monthly_increase = potential_monthly - current_monthly
+
             analysis['executive_summary'].update({
                 'current_combined_rating': current_rating,
                 'potential_combined_rating': potential_rating,
-                'current_monthly_compensation': VA_COMPENSATION_RATES.get(current_rating, 0),
-                'potential_monthly_compensation': VA_COMPENSATION_RATES.get(potential_rating, 0),
-                'monthly_increase_potential': VA_COMPENSATION_RATES.get(potential_rating, 0) - VA_COMPENSATION_RATES.get(current_rating, 0),
-                'annual_increase_potential': (VA_COMPENSATION_RATES.get(potential_rating, 0) - VA_COMPENSATION_RATES.get(current_rating, 0)) * 12
+                'current_monthly_compensation': current_monthly,
+                'potential_monthly_compensation': potential_monthly,
+                'monthly_increase_potential': monthly_increase,
+                'annual_increase_potential': monthly_increase * 12
             })
         
         # Add metadata
         analysis['metadata'] = {
-            'analysis_date': datetime.now().isoformat(),
+            'analysis_date': veteran_info.get('processed_at') or datetime.now().isoformat(),
             'veteran_name': veteran_info['name'],
             'report_id': veteran_info['report_id'],
             'ai_backend': 'Claude-3.5-Sonnet',
@@ -1261,7 +1159,7 @@ def validate_and_enrich_analysis(analysis: Dict, veteran_info: Dict) -> Dict[str
         return analysis
         
     except Exception as e:
-        print(f"❌ Error validating analysis: {e}")
+        logger.error("❌ Error validating analysis: %s", e)
         return analysis
 
 def calculate_combined_rating(individual_ratings: List[int]) -> int:
@@ -1270,11 +1168,16 @@ def calculate_combined_rating(individual_ratings: List[int]) -> int:
         return 0
     
     # Sort ratings in descending order
-    sorted_ratings = sorted([r for r in individual_ratings if r > 0], reverse=True)
+    sorted_ratings = tuple(sorted((r for r in individual_ratings if r > 0), reverse=True))
     
     if not sorted_ratings:
         return 0
     
+    return _combine_sorted_ratings(sorted_ratings)
+
+@functools.lru_cache(maxsize=4096)
+def _combine_sorted_ratings(sorted_ratings: tuple) -> int:
+    """Fold descending ratings through the VA formula; memoized since the rating space is tiny"""
     # Start with highest rating
     combined = sorted_ratings[0]
     
@@ -1292,906 +1195,438 @@ def calculate_combined_rating(individual_ratings: List[int]) -> int:
     else:
         return min(rounded, 100)
 
+# Canned analysis used when Claude is unavailable; each fallback gets its own deep
+# copy, so enriching one in place can never leak into later fallbacks
+FALLBACK_AI_BACKEND = "Claude-3.5-Sonnet (Fallback)"
+FALLBACK_ANALYSIS_SECTIONS = {
+    "executive_summary": {
+        "current_combined_rating": 70,
+        "potential_combined_rating": 90,
+        "current_monthly_compensation": 1716,
+        "potential_monthly_compensation": 2241,
+        "monthly_increase_potential": 525,
+        "annual_increase_potential": 6300,
+        "total_conditions_analyzed": 4,
+        "high_priority_opportunities": 2,
+        "key_findings": [
+            "PTSD rating increase opportunity from 50% to 70%",
+            "Sleep apnea secondary claim opportunity",
+            "Depression secondary service connection potential"
+        ]
+    },
+    "current_service_connected_conditions": [
+        {
+            "condition_name": "PTSD",
+            "current_rating": 50,
+            "diagnostic_code": "9411",
+            "potential_rating": 70,
+            "cfr_citation": "38 CFR 4.130",
+            "evidence_strength": "High",
+            "supporting_evidence": "Sleep disturbances, social isolation, occupational impairment documented",
+            "rating_criteria_met": "Occupational and social impairment with deficiencies in most areas",
+            "probability_increase": "High",
+            "action_required": "Updated mental health evaluation focusing on occupational impacts",
+            "timeline": "60-90 days"
+        }
+    ],
+    "missed_claiming_opportunities": [
+        {
+            "condition_name": "Sleep Apnea",
+            "connection_type": "Secondary",
+            "primary_condition": "PTSD",
+            "potential_rating": 50,
+            "diagnostic_code": "6847",
+            "cfr_citation": "38 CFR 4.97",
+            "supporting_evidence": "Sleep disturbances documented, CPAP use likely",
+            "nexus_strength": "Strong",
+            "recommended_strategy": "File secondary claim with sleep study",
+            "evidence_needed": "Sleep study results, nexus letter",
+            "success_probability": "High"
+        }
+    ]
+}
+
 def generate_fallback_analysis(veteran_info: Dict) -> Dict[str, Any]:
     """Generate fallback analysis if Claude fails"""
     return {
-        "executive_summary": {
-            "current_combined_rating": 70,
-            "potential_combined_rating": 90,
-            "current_monthly_compensation": 1716,
-            "potential_monthly_compensation": 2241,
-            "monthly_increase_potential": 525,
-            "annual_increase_potential": 6300,
-            "total_conditions_analyzed": 4,
-            "high_priority_opportunities": 2,
-            "key_findings": [
-                "PTSD rating increase opportunity from 50% to 70%",
-                "Sleep apnea secondary claim opportunity",
-                "Depression secondary service connection potential"
-            ]
-        },
-        "current_service_connected_conditions": [
-            {
-                "condition_name": "PTSD",
-                "current_rating": 50,
-                "diagnostic_code": "9411",
-                "potential_rating": 70,
-                "cfr_citation": "38 CFR 4.130",
-                "evidence_strength": "High",
-                "supporting_evidence": "Sleep disturbances, social isolation, occupational impairment documented",
-                "rating_criteria_met": "Occupational and social impairment with deficiencies in most areas",
-                "probability_increase": "High",
-                "action_required": "Updated mental health evaluation focusing on occupational impacts",
-                "timeline": "60-90 days"
-            }
-        ],
-        "missed_claiming_opportunities": [
-            {
-                "condition_name": "Sleep Apnea",
-                "connection_type": "Secondary",
-                "primary_condition": "PTSD",
-                "potential_rating": 50,
-                "diagnostic_code": "6847",
-                "cfr_citation": "38 CFR 4.97",
-                "supporting_evidence": "Sleep disturbances documented, CPAP use likely",
-                "nexus_strength": "Strong",
-                "recommended_strategy": "File secondary claim with sleep study",
-                "evidence_needed": "Sleep study results, nexus letter",
-                "success_probability": "High"
-            }
-        ],
+        **copy.deepcopy(FALLBACK_ANALYSIS_SECTIONS),
         "metadata": {
-            "analysis_date": datetime.now().isoformat(),
+            "analysis_date": veteran_info.get('processed_at') or datetime.now().isoformat(),
             "veteran_name": veteran_info['name'],
             "report_id": veteran_info['report_id'],
-            "ai_backend": "Claude-3.5-Sonnet (Fallback)",
+            "ai_backend": FALLBACK_AI_BACKEND,
             "rater_mode": "Senior VA Claims Rater (GS-13)"
         }
     }
 
-def generate_comprehensive_html_report(analysis: Dict, veteran_info: Dict, medical_text: str) -> str:
-    """Generate comprehensive responsive HTML report"""
+def is_fallback_analysis(analysis: Dict) -> bool:
+    """True for the canned analysis returned when Claude failed"""
+    return analysis.get('metadata', {}).get('ai_backend') == FALLBACK_AI_BACKEND
+
+# Report layout lives in templates/report.html.j2, compiled to bytecode once at import
+REPORT_TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+report_env = Environment(
+    loader=FileSystemLoader(REPORT_TEMPLATE_DIR),
+    autoescape=True,
+    auto_reload=False,
+    trim_blocks=True,
+    lstrip_blocks=True
+)
+# "$1,234" in a single bound-method call
+format_money = '${:,}'.format
+report_env.filters['money'] = format_money
+
+# Claude answers "High/Moderate/Low" while the stylesheet only styles high/medium/low,
+# so map levels to a fixed class set (unknown values get the neutral medium styling)
+PRIORITY_CSS_CLASSES = {
+    'high': 'priority-high',
+    'medium': 'priority-medium',
+    'moderate': 'priority-medium',
+    'low': 'priority-low'
+}
+
+def get_priority_css_class(level: Optional[str]) -> str:
+    """CSS class for a priority / strength / probability level"""
+    return PRIORITY_CSS_CLASSES.get(str(level or '').strip().lower(), 'priority-medium')
+
+def get_connection_css_class(connection_type: Optional[str]) -> str:
+    """CSS class for a service-connection type tag"""
+    return 'connection-secondary' if 'secondary' in str(connection_type or '').lower() else 'connection-direct'
+
+report_env.filters['priority_class'] = get_priority_css_class
+report_env.filters['connection_class'] = get_connection_css_class
+CSS_COMMENT_RE = re.compile(r"/\*.*?\*/", re.DOTALL)
+CSS_PUNCTUATION_SPACE_RE = re.compile(r"\s*([{}:;,])\s*")
+TEMPLATE_STYLE_RE = re.compile(r"(<style>)(.*?)(</style>)", re.DOTALL)
+TEMPLATE_INDENT_RE = re.compile(r"\n[ \t]*(?:\n[ \t]*)*")
+
+def minify_report_template(source: str) -> str:
+    """Minify the report template source once at import: compact the stylesheet and drop indentation"""
+    def minify_css(match: re.Match) -> str:
+        css = CSS_COMMENT_RE.sub('', match.group(2))
+        css = CSS_PUNCTUATION_SPACE_RE.sub(r'\1', ' '.join(css.split()))
+        return match.group(1) + css.replace(';}', '}') + match.group(3)
+    
+    # Line breaks are kept (the inline script has // comments); only the
+    # indentation and blank lines between them go
+    return TEMPLATE_INDENT_RE.sub('\n', TEMPLATE_STYLE_RE.sub(minify_css, source))
+
+# The template is minified before compiling, so every render emits compact markup for free
+REPORT_TPL = report_env.from_string(
+    minify_report_template(report_env.loader.get_source(report_env, 'report.html.j2')[0])
+)
+REPORT_STREAM_BUFFER_FRAGMENTS = 64
+
+# Reports are mostly repeated CSS and class names and shrink ~10x under gzip
+REPORT_GZIP_LEVEL = 6
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+# Executive summary amounts, formatted once per render rather than inline in the template
+REPORT_MONEY_FIELDS = (
+    'current_monthly_compensation',
+    'monthly_increase_potential',
+    'annual_increase_potential'
+)
+
+# Report section layouts, in display order
+REPORT_SCENARIO_LABELS = (
+    ('current_calculation', 'Current Rating'),
+    ('conservative_scenario', 'Conservative Estimate'),
+    ('realistic_scenario', 'Realistic Target'),
+    ('optimistic_scenario', 'Maximum Potential')
+)
+REPORT_ACTION_CATEGORIES = (
+    ('immediate_actions', 'Immediate Actions (0-30 Days)', 'high'),
+    ('short_term_actions', 'Short-Term Actions (30-90 Days)', 'medium'),
+    ('long_term_actions', 'Long-Term Strategy (90+ Days)', 'low')
+)
+REPORT_GAP_CATEGORIES = (
+    ('critical_missing_evidence', 'Critical Missing Evidence', '🔴'),
+    ('medical_opinions_needed', 'Medical Opinions Needed', '⚕️'),
+    ('lay_statements_recommended', 'Lay Statements Recommended', '📝'),
+    ('additional_testing_suggested', 'Additional Testing Suggested', '🧪')
+)
+
+def build_report_context(analysis: Dict, veteran_info: Dict) -> Dict[str, Any]:
+    """Build the template context for the comprehensive HTML report"""
     
     # Extract analysis data
-    exec_summary = analysis.get('executive_summary', {})
-    current_conditions = analysis.get('current_service_connected_conditions', [])
-    new_opportunities = analysis.get('missed_claiming_opportunities', [])
     action_plan = analysis.get('strategic_action_plan', {})
     evidence_gaps = analysis.get('evidence_gaps_analysis', {})
     rating_scenarios = analysis.get('combined_rating_scenarios', {})
+    summary = analysis.get('executive_summary', {})
     
-    # Build current conditions table
-    current_conditions_html = ""
-    for condition in current_conditions:
-        evidence_strength_class = condition.get('evidence_strength', 'medium').lower()
-        probability_class = condition.get('probability_increase', 'medium').lower()
-        
-        current_conditions_html += f"""
-        <tr>
-            <td><strong>{condition.get('condition_name', 'Unknown Condition')}</strong><br>
-                <small>Code: {condition.get('diagnostic_code', 'N/A')}</small></td>
-            <td class="text-center"><span class="rating-badge current">{condition.get('current_rating', 0)}%</span></td>
-            <td class="text-center"><span class="rating-badge potential">{condition.get('potential_rating', 0)}%</span></td>
-            <td><span class="priority-{evidence_strength_class}">{condition.get('evidence_strength', 'Unknown')}</span></td>
-            <td><span class="priority-{probability_class}">{condition.get('probability_increase', 'Unknown')}</span></td>
-            <td>{condition.get('action_required', 'Review needed')}</td>
-        </tr>
-        """
-    
-    # Build new opportunities
-    new_opportunities_html = ""
-    for opp in new_opportunities:
-        connection_type_class = "secondary" if "secondary" in opp.get('connection_type', '').lower() else "direct"
-        
-        new_opportunities_html += f"""
-        <div class="opportunity-card">
-            <div class="opportunity-header">
-                <h4>🎯 {opp.get('condition_name', 'New Opportunity')}</h4>
-                <span class="rating-badge potential">{opp.get('potential_rating', 0)}%</span>
-            </div>
-            <div class="opportunity-details">
-                <p><strong>Connection Type:</strong> <span class="connection-{connection_type_class}">{opp.get('connection_type', 'Unknown')}</span></p>
-                <p><strong>Diagnostic Code:</strong> {opp.get('diagnostic_code', 'TBD')}</p>
-                <p><strong>Supporting Evidence:</strong> {opp.get('supporting_evidence', 'Evidence to be developed')}</p>
-                <p><strong>Success Probability:</strong> <span class="priority-{opp.get('success_probability', 'medium').lower()}">{opp.get('success_probability', 'Medium')}</span></p>
-                <p><strong>Recommended Strategy:</strong> {opp.get('recommended_strategy', 'Contact for details')}</p>
-            </div>
-        </div>
-        """
-    
-    # Build rating scenarios
-    scenarios_html = ""
-    scenario_labels = {
-        'current_calculation': 'Current Rating',
-        'conservative_scenario': 'Conservative Estimate',
-        'realistic_scenario': 'Realistic Target',
-        'optimistic_scenario': 'Maximum Potential'
-    }
-    
-    for scenario_key, scenario_label in scenario_labels.items():
-        scenario = rating_scenarios.get(scenario_key, {})
-        if scenario:
-            combined_rating = scenario.get('combined_rating', 0)
-            monthly_comp = scenario.get('monthly_compensation', 0)
-            individual_ratings = scenario.get('individual_ratings', [])
-            
-            scenarios_html += f"""
-            <div class="scenario-card">
-                <h4>{scenario_label}</h4>
-                <div class="scenario-stats">
-                    <div class="stat">
-                        <span class="stat-number">{combined_rating}%</span>
-                        <span class="stat-label">Combined Rating</span>
-                    </div>
-                    <div class="stat">
-                        <span class="stat-number">${monthly_comp:,}</span>
-                        <span class="stat-label">Monthly</span>
-                    </div>
-                    <div class="stat">
-                        <span class="stat-number">${monthly_comp * 12:,}</span>
-                        <span class="stat-label">Annual</span>
-                    </div>
-                </div>
-                <div class="individual-ratings">
-                    <strong>Individual Ratings:</strong> {' + '.join([f'{r}%' for r in individual_ratings]) if individual_ratings else 'N/A'}
-                </div>
-            </div>
-            """
-    
-    # Build action plan
-    action_plan_html = ""
-    action_categories = [
-        ('immediate_actions', 'Immediate Actions (0-30 Days)', 'high'),
-        ('short_term_actions', 'Short-Term Actions (30-90 Days)', 'medium'),
-        ('long_term_actions', 'Long-Term Strategy (90+ Days)', 'low')
-    ]
-    
-    for category_key, category_title, default_priority in action_categories:
-        actions = action_plan.get(category_key, [])
-        if actions:
-            action_plan_html += f"""
-            <div class="action-category">
-                <h4>{category_title}</h4>
-            """
-            
-            for action in actions:
-                priority = action.get('priority', default_priority).lower()
-                action_plan_html += f"""
-                <div class="action-item priority-{priority}">
-                    <div class="action-header">
-                        <h5>{action.get('action', 'Action Required')}</h5>
-                        <span class="priority-badge priority-{priority}">{action.get('priority', 'Medium')}</span>
-                    </div>
-                    <p><strong>Impact:</strong> {action.get('impact', 'Impact assessment pending')}</p>
-                    <p><strong>Timeline:</strong> {action.get('timeline', action.get('deadline', 'TBD'))}</p>
-                    {f"<p><strong>Resources Needed:</strong> {action.get('resources_needed', '')}</p>" if action.get('resources_needed') else ""}
-                </div>
-                """
-            
-            action_plan_html += "</div>"
+    # One clock read so the header and footer timestamps always match; the header
+    # shows local time and the footer the same instant in UTC
+    now = datetime.now(timezone.utc)
     
-    # Build evidence gaps
-    evidence_gaps_html = ""
-    gap_categories = [
-        ('critical_missing_evidence', 'Critical Missing Evidence', '🔴'),
-        ('medical_opinions_needed', 'Medical Opinions Needed', '⚕️'),
-        ('lay_statements_recommended', 'Lay Statements Recommended', '📝'),
-        ('additional_testing_suggested', 'Additional Testing Suggested', '🧪')
+    # Only non-empty groups are rendered; the template shows a placeholder when none remain
+    return dict(
+        veteran=veteran_info,
+        summary=summary,
+        money={field: format_money(summary.get(field, 0)) for field in REPORT_MONEY_FIELDS},
+        current_conditions=analysis.get('current_service_connected_conditions', []),
+        new_opportunities=analysis.get('missed_claiming_opportunities', []),
+        scenarios=[
+            (scenario_label, rating_scenarios[scenario_key])
+            for scenario_key, scenario_label in REPORT_SCENARIO_LABELS
+            if rating_scenarios.get(scenario_key)
+        ],
+        action_groups=[
+            (category_title, default_priority, action_plan[category_key])
+            for category_key, category_title, default_priority in REPORT_ACTION_CATEGORIES
+            if action_plan.get(category_key)
+        ],
+        evidence_gap_groups=[
+            (gap_icon, gap_title, evidence_gaps[gap_key])
+            for gap_key, gap_title, gap_icon in REPORT_GAP_CATEGORIES
+            if evidence_gaps.get(gap_key)
+        ],
+        analysis_date=now.astimezone().strftime('%B %d, %Y at %I:%M %p'),
+        generated_at=now.strftime('%Y-%m-%d %H:%M UTC')
+    )
+
+def stream_comprehensive_html_report(analysis: Dict, veteran_info: Dict):
+    """Render the report incrementally so a browser can start on the head and CSS right away"""
+    # Buffer a few template fragments per chunk rather than one tiny write per node
+    report_stream = REPORT_TPL.stream(build_report_context(analysis, veteran_info))
+    report_stream.enable_buffering(REPORT_STREAM_BUFFER_FRAGMENTS)
+    return report_stream
+
+def render_compressed_report(analysis: Dict, veteran_info: Dict) -> bytes:
+    """Render the report straight into gzipped UTF-8 for the report cache and the WorkDrive upload"""
+    # Encode and compress fragment by fragment, so neither the full HTML str
+    # nor its full UTF-8 copy is ever held in memory
+    compressor = zlib.compressobj(REPORT_GZIP_LEVEL, zlib.DEFLATED, GZIP_WBITS)
+    compressed_parts = [
+        compressor.compress(fragment.encode('utf-8'))
+        for fragment in stream_comprehensive_html_report(analysis, veteran_info)
     ]
-    
-    for gap_key, gap_title, gap_icon in gap_categories:
-        gaps = evidence_gaps.get(gap_key, [])
-        if gaps:
-            evidence_gaps_html += f"""
-            <div class="evidence-gap-section">
-                <h4>{gap_icon} {gap_title}</h4>
-                <ul class="evidence-gap-list">
-            """
-            for gap in gaps:
-                evidence_gaps_html += f"<li>{gap}</li>"
-            evidence_gaps_html += "</ul></div>"
-    
-    # Calculate key metrics
-    current_rating = exec_summary.get('current_combined_rating', 0)
-    potential_rating = exec_summary.get('potential_combined_rating', 0)
-    current_monthly = exec_summary.get('current_monthly_compensation', 0)
-    potential_monthly = exec_summary.get('potential_monthly_compensation', 0)
-    monthly_increase = exec_summary.get('monthly_increase_potential', 0)
-    annual_increase = exec_summary.get('annual_increase_potential', 0)
-    
-    # Generate the complete HTML report
-    report_html = f"""
-    <!DOCTYPE html>
-    <html lang="en">
-    <head>
-        <meta charset="UTF-8">
-        <meta name="viewport" content="width=device-width, initial-scale=1.0">
-        <title>VA Disability Claims Analysis - {veteran_info['name']}</title>
-        <style>
-            * {{
-                margin: 0;
-                padding: 0;
-                box-sizing: border-box;
-            }}
-            
-            body {{
-                font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-                line-height: 1.6;
-                color: #333;
-                background-color: #f8fafc;
-            }}
-            
-            .container {{
-                max-width: 1200px;
-                margin: 0 auto;
-                background: white;
-                box-shadow: 0 0 20px rgba(0,0,0,0.1);
-            }}
-            
-            .header {{
-                background: linear-gradient(135deg, #1e3a8a 0%, #3b82f6 100%);
-                color: white;
-                padding: 2rem;
-                text-align: center;
-                position: relative;
-            }}
-            
-            .logo {{
-                position: absolute;
-                top: 1rem;
-                left: 2rem;
-                height: 60px;
-                width: auto;
-            }}
-            
-            .header h1 {{
-                font-size: 2.5rem;
-                margin-bottom: 0.5rem;
-                font-weight: 700;
-            }}
-            
-            .header h2 {{
-                font-size: 1.8rem;
-                margin-bottom: 1rem;
-                opacity: 0.9;
-            }}
-            
-            .file-info {{
-                background: rgba(255,255,255,0.1);
-                padding: 1rem;
-                border-radius: 8px;
-                margin-top: 1rem;
-                font-size: 0.9rem;
-                backdrop-filter: blur(10px);
-            }}
-            
-            .executive-summary {{
-                background: linear-gradient(135deg, #e0f2fe 0%, #b3e5fc 100%);
-                padding: 2rem;
-                border-left: 6px solid #1e3a8a;
-            }}
-            
-            .summary-stats {{
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(250px, 1fr));
-                gap: 1.5rem;
-                margin: 1.5rem 0;
-            }}
-            
-            .stat-card {{
-                background: white;
-                padding: 1.5rem;
-                border-radius: 12px;
-                text-align: center;
-                box-shadow: 0 4px 6px rgba(0,0,0,0.1);
-                transition: transform 0.2s ease;
-            }}
-            
-            .stat-card:hover {{
-                transform: translateY(-2px);
-            }}
-            
-            .stat-number {{
-                font-size: 2rem;
-                font-weight: bold;
-                color: #1e3a8a;
-                display: block;
-            }}
-            
-            .stat-label {{
-                color: #6b7280;
-                font-size: 0.9rem;
-                margin-top: 0.5rem;
-            }}
-            
-            .increase {{
-                color: #059669 !important;
-            }}
-            
-            .section {{
-                padding: 2rem;
-                border-bottom: 1px solid #e5e7eb;
-            }}
-            
-            .section h2 {{
-                color: #1e3a8a;
-                border-bottom: 3px solid #3b82f6;
-                padding-bottom: 1rem;
-                margin-bottom: 1.5rem;
-                font-size: 1.8rem;
-            }}
-            
-            .conditions-table {{
-                width: 100%;
-                border-collapse: collapse;
-                margin: 1.5rem 0;
-                background: white;
-                border-radius: 8px;
-                overflow: hidden;
-                box-shadow: 0 2px 8px rgba(0,0,0,0.1);
-            }}
-            
-            .conditions-table th,
-            .conditions-table td {{
-                padding: 1rem;
-                text-align: left;
-                border-bottom: 1px solid #e5e7eb;
-            }}
-            
-            .conditions-table th {{
-                background: linear-gradient(135deg, #f8fafc 0%, #e2e8f0 100%);
-                font-weight: 600;
-                color: #1e3a8a;
-                font-size: 0.9rem;
-            }}
-            
-            .conditions-table tr:hover {{
-                background-color: #f8fafc;
-            }}
-            
-            .rating-badge {{
-                display: inline-block;
-                padding: 0.25rem 0.75rem;
-                border-radius: 20px;
-                font-weight: bold;
-                font-size: 0.9rem;
-            }}
-            
-            .rating-badge.current {{
-                background: #fee2e2;
-                color: #dc2626;
-            }}
-            
-            .rating-badge.potential {{
-                background: #dcfce7;
-                color: #16a34a;
-            }}
-            
-            .priority-high {{ 
-                color: #16a34a; 
-                font-weight: bold; 
-            }}
-            
-            .priority-medium {{ 
-                color: #d97706; 
-                font-weight: bold; 
-            }}
-            
-            .priority-low {{ 
-                color: #6b7280; 
-            }}
-            
-            .opportunity-card {{
-                background: linear-gradient(135deg, #f0fdf4 0%, #dcfce7 100%);
-                border: 1px solid #bbf7d0;
-                border-left: 6px solid #16a34a;
-                border-radius: 12px;
-                padding: 1.5rem;
-                margin: 1rem 0;
-                box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-            }}
-            
-            .opportunity-header {{
-                display: flex;
-                justify-content: space-between;
-                align-items: center;
-                margin-bottom: 1rem;
-            }}
-            
-            .opportunity-header h4 {{
-                color: #166534;
-                font-size: 1.3rem;
-            }}
-            
-            .opportunity-details p {{
-                margin-bottom: 0.5rem;
-            }}
-            
-            .connection-secondary {{
-                background: #fef3c7;
-                color: #92400e;
-                padding: 0.25rem 0.5rem;
-                border-radius: 4px;
-                font-size: 0.8rem;
-            }}
-            
-            .connection-direct {{
-                background: #dbeafe;
-                color: #1d4ed8;
-                padding: 0.25rem 0.5rem;
-                border-radius: 4px;
-                font-size: 0.8rem;
-            }}
-            
-            .scenario-grid {{
-                display: grid;
-                grid-template-columns: repeat(auto-fit, minmax(280px, 1fr));
-                gap: 1.5rem;
-                margin: 1.5rem 0;
-            }}
-            
-            .scenario-card {{
-                background: white;
-                border: 2px solid #e5e7eb;
-                border-radius: 12px;
-                padding: 1.5rem;
-                box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-            }}
-            
-            .scenario-card h4 {{
-                color: #1e3a8a;
-                margin-bottom: 1rem;
-                font-size: 1.1rem;
-            }}
-            
-            .scenario-stats {{
-                display: grid;
-                grid-template-columns: repeat(3, 1fr);
-                gap: 1rem;
-                margin-bottom: 1rem;
-            }}
-            
-            .stat {{
-                text-align: center;
-            }}
-            
-            .stat .stat-number {{
-                font-size: 1.3rem;
-                font-weight: bold;
-                color: #1e3a8a;
-            }}
-            
-            .stat .stat-label {{
-                font-size: 0.8rem;
-                color: #6b7280;
-            }}
-            
-            .individual-ratings {{
-                font-size: 0.9rem;
-                color: #6b7280;
-                padding-top: 1rem;
-                border-top: 1px solid #e5e7eb;
-            }}
-            
-            .action-category {{
-                margin-bottom: 2rem;
-            }}
-            
-            .action-category h4 {{
-                color: #1e3a8a;
-                margin-bottom: 1rem;
-                padding-bottom: 0.5rem;
-                border-bottom: 2px solid #3b82f6;
-            }}
-            
-            .action-item {{
-                background: white;
-                border-left: 4px solid #6b7280;
-                border-radius: 8px;
-                padding: 1.5rem;
-                margin: 1rem 0;
-                box-shadow: 0 2px 4px rgba(0,0,0,0.05);
-            }}
-            
-            .action-item.priority-high {{
-                border-left-color: #dc2626;
-                background: linear-gradient(135deg, #fef2f2 0%, #fee2e2 100%);
-            }}
-            
-            .action-item.priority-medium {{
-                border-left-color: #d97706;
-                background: linear-gradient(135deg, #fffbeb 0%, #fef3c7 100%);
-            }}
-            
-            .action-item.priority-low {{
-                border-left-color: #059669;
-                background: linear-gradient(135deg, #f0fdf4 0%, #dcfce7 100%);
-            }}
-            
-            .action-header {{
-                display: flex;
-                justify-content: space-between;
-                align-items: center;
-                margin-bottom: 1rem;
-            }}
-            
-            .action-header h5 {{
-                color: #1e3a8a;
-                font-size: 1.1rem;
-            }}
-            
-            .priority-badge {{
-                padding: 0.25rem 0.75rem;
-                border-radius: 20px;
-                font-size: 0.8rem;
-                font-weight: bold;
-            }}
-            
-            .priority-badge.priority-high {{
-                background: #dc2626;
-                color: white;
-            }}
-            
-            .priority-badge.priority-medium {{
-                background: #d97706;
-                color: white;
-            }}
-            
-            .priority-badge.priority-low {{
-                background: #059669;
-                color: white;
-            }}
-            
-            .evidence-gap-section {{
-                margin-bottom: 1.5rem;
-            }}
-            
-            .evidence-gap-section h4 {{
-                color: #dc2626;
-                margin-bottom: 0.5rem;
-                font-size: 1.1rem;
-            }}
-            
-            .evidence-gap-list {{
-                background: #fef2f2;
-                border-left: 4px solid #dc2626;
-                padding: 1rem 1rem 1rem 2rem;
-                border-radius: 0 8px 8px 0;
-            }}
-            
-            .evidence-gap-list li {{
-                margin-bottom: 0.5rem;
-                color: #374151;
-            }}
-            
-            .footer {{
-                background: #f8fafc;
-                padding: 2rem;
-                text-align: center;
-                font-size: 0.9rem;
-                color: #6b7280;
-                border-top: 3px solid #e5e7eb;
-            }}
-            
-            .disclaimer {{
-                background: #fef3c7;
-                border: 1px solid #f59e0b;
-                border-radius: 8px;
-                padding: 1rem;
-                margin: 1rem 0;
-                font-size: 0.9rem;
-            }}
-            
-            .print-button {{
-                background: #3b82f6;
-                color: white;
-                border: none;
-                padding: 0.75rem 1.5rem;
-                border-radius: 8px;
-                cursor: pointer;
-                font-size: 1rem;
-                margin: 1rem 0;
-                transition: background-color 0.2s;
-            }}
-            
-            .print-button:hover {{
-                background: #2563eb;
-            }}
-            
-            /* Mobile Responsive */
-            @media (max-width: 768px) {{
-                .logo {{
-                    height: 35px;
-                    top: 0.5rem;
-                    left: 1rem;
-                }}
-                
-                .header {{
-                    padding: 1.5rem 1rem;
-                }}
-                
-                .header h1 {{
-                    font-size: 1.8rem;
-                    margin-top: 2rem;
-                }}
-                
-                .header h2 {{
-                    font-size: 1.3rem;
-                }}
-                
-                .section {{
-                    padding: 1.5rem 1rem;
-                }}
-                
-                .conditions-table {{
-                    font-size: 0.8rem;
-                }}
-                
-                .conditions-table th,
-                .conditions-table td {{
-                    padding: 0.5rem;
-                }}
-                
-                .summary-stats {{
-                    grid-template-columns: 1fr;
-                }}
-                
-                .scenario-grid {{
-                    grid-template-columns: 1fr;
-                }}
-                
-                .action-header {{
-                    flex-direction: column;
-                    align-items: flex-start;
-                }}
-                
-                .action-header h5 {{
-                    margin-bottom: 0.5rem;
-                }}
-            }
-            
-            @media print {{
-                .print-button {{
-                    display: none;
-                }}
-                
-                .container {{
-                    box-shadow: none;
-                }}
-                
-                .section {{
-                    break-inside: avoid;
-                    page-break-inside: avoid;
-                }}
-                
-                .action-item, .opportunity-card {{
-                    break-inside: avoid;
-                    page-break-inside: avoid;
-                }}
-            }}
-        </style>
-    </head>
-    <body>
-        <div class="container">
-            <div class="header">
-                <img src="https://www.vetletters.com/sitelogo.png" alt="VetLetters Logo" class="logo">
-                <h1>🎖️ VA Disability Claims Analysis</h1>
-                <h2>{veteran_info['name']}</h2>
-                <div class="file-info">
-                    <strong>Source File:</strong> {veteran_info['filename']} ({veteran_info['file_size']})<br>
-                    <strong>Uploaded:</strong> {veteran_info['uploaded_time']}<br>
-                    <strong>Analysis Date:</strong> {datetime.now().strftime('%B %d, %Y at %I:%M %p')}<br>
-                    <strong>Report ID:</strong> {veteran_info['report_id']}<br>
-                    <strong>AI Backend:</strong> Claude-3.5-Sonnet (Senior Rater Mode)
-                </div>
-            </div>
-
-            <div class="executive-summary">
-                <h2>📊 Executive Summary</h2>
-                <button class="print-button" onclick="window.print()">🖨️ Print Report</button>
-                
-                <div class="summary-stats">
-                    <div class="stat-card">
-                        <span class="stat-number">{current_rating}%</span>
-                        <span class="stat-label">Current Combined Rating</span>
-                    </div>
-                    <div class="stat-card">
-                        <span class="stat-number">{potential_rating}%</span>
-                        <span class="stat-label">Potential Combined Rating</span>
-                    </div>
-                    <div class="stat-card">
-                        <span class="stat-number">${current_monthly:,}</span>
-                        <span class="stat-label">Current Monthly Compensation</span>
-                    </div>
-                    <div class="stat-card">
-                        <span class="stat-number increase">+${monthly_increase:,}</span>
-                        <span class="stat-label">Monthly Increase Potential</span>
-                    </div>
-                </div>
-                
-                <div class="disclaimer">
-                    <strong>📈 Annual Increase Potential:</strong> 
-                    <span style="color: #16a34a; font-size: 1.5rem; font-weight: bold;">${annual_increase:,}</span>
-                </div>
-                
-                <div style="margin-top: 1rem;">
-                    <h3>Key Findings:</h3>
-                    <ul style="margin-left: 1.5rem;">
-                        {chr(10).join([f'<li>{finding}</li>' for finding in exec_summary.get('key_findings', [])])}
-                    </ul>
-                </div>
-            </div>
-
-            <div class="section">
-                <h2>📋 Current Service-Connected Conditions Analysis</h2>
-                <div style="overflow-x: auto;">
-                    <table class="conditions-table">
-                        <thead>
-                            <tr>
-                                <th>Condition & Code</th>
-                                <th>Current</th>
-                                <th>Potential</th>
-                                <th>Evidence Strength</th>
-                                <th>Increase Probability</th>
-                                <th>Action Required</th>
-                            </tr>
-                        </thead>
-                        <tbody>
-                            {current_conditions_html or '<tr><td colspan="6"><em>No current service-connected conditions identified in available records</em></td></tr>'}
-                        </tbody>
-                    </table>
-                </div>
-            </div>
-
-            <div class="section">
-                <h2>🎯 Missed Claiming Opportunities</h2>
-                {new_opportunities_html or '<p><em>No new claiming opportunities identified in current records. Focus on maximizing existing conditions.</em></p>'}
-            </div>
-
-            <div class="section">
-                <h2>🎲 Combined Rating Scenarios</h2>
-                <div class="scenario-grid">
-                    {scenarios_html}
-                </div>
-            </div>
-
-            <div class="section">
-                <h2>⚡ Strategic Action Plan</h2>
-                {action_plan_html or '<p><em>No specific actions identified. Review medical records for additional opportunities.</em></p>'}
-            </div>
-
-            <div class="section">
-                <h2>📄 Evidence Gap Analysis</h2>
-                {evidence_gaps_html or '<p><em>No critical evidence gaps identified in available records</em></p>'}
-            </div>
-
-            <div class="section">
-                <h2>🚀 Next Steps & Recommendations</h2>
-                <ol style="font-size: 1.1rem; line-height: 1.8; margin-left: 1.5rem;">
-                    <li><strong>Review this comprehensive analysis</strong> - Focus on high-priority opportunities with greatest financial impact</li>
-                    <li><strong>Gather missing evidence</strong> - Address critical gaps identified in the evidence section above</li>
-                    <li><strong>Schedule professional consultation</strong> - Discuss complex strategies and optimal filing approaches</li>
-                    <li><strong>Implement strategic action plan</strong> - Begin with immediate actions for maximum benefit</li>
-                    <li><strong>Monitor claim progress</strong> - Track filing deadlines and C&P examination schedules</li>
-                    <li><strong>Document functional impacts</strong> - Prepare detailed lay statements showing real-world effects</li>
-                </ol>
-            </div>
-
-            <div class="footer">
-                <div class="disclaimer">
-                    <strong>⚖️ LEGAL DISCLAIMER:</strong> This analysis is educational and for preparation purposes only. 
-                    No legal advice, representation, or advocacy is provided. Veterans should consult qualified 
-                    attorneys or accredited representatives for legal advice and claim assistance.
-                </div>
-                
-                <p style="margin-top: 1.5rem;">
-                    <strong>🤖 Generated by Claude-3.5-Sonnet VA Senior Rater Analysis</strong><br>
-                    Report ID: {veteran_info['report_id']} | Generated: {datetime.now().strftime('%Y-%m-%d %H:%M UTC')}<br>
-                    Source: {veteran_info['filename']} | <strong>Confidential and Proprietary</strong>
-                </p>
-                
-                <div style="margin-top: 1rem; padding-top: 1rem; border-top: 1px solid #e5e7eb;">
-                    <p><strong>Applied Senior Rater Principles:</strong></p>
-                    <p>✓ Benefit-of-the-Doubt Doctrine Applied | ✓ Maximization Strategy Used | ✓ 38 CFR Part 4 Compliance</p>
-                    <p>✓ Combined Rating Table Applied | ✓ Secondary Service Connection Analyzed | ✓ Evidence Gaps Identified</p>
-                </div>
-            </div>
-        </div>
-
-        <script>
-            // Add any interactive functionality here
-            document.addEventListener('DOMContentLoaded', function() {{
-                // Highlight high-priority items
-                const highPriorityItems = document.querySelectorAll('.priority-high');
-                highPriorityItems.forEach(item => {{
-                    item.style.fontWeight = 'bold';
-                }});
-                
-                // Add click handlers for expandable sections if needed
-                console.log('VA Claims Analysis Report loaded successfully');
-            }});
-        </script>
-    </body>
-    </html>
-    """
-    
-    return report_html
+    compressed_parts.append(compressor.flush())
+    return b"".join(compressed_parts)
 
-def upload_report_to_workdrive(report_html: str, veteran_info: Dict) -> str:
-    """Upload HTML report to WorkDrive"""
+async def upload_report_to_workdrive(report_gz: bytes, veteran_info: Dict) -> str:
+    """Upload gzipped HTML report to WorkDrive"""
     try:
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         clean_name = veteran_info['name'].replace(' ', '_').replace('-', '_').lower()
         filename = f"va_senior_rater_analysis_{clean_name}_{timestamp}.html"
         
-        print(f"📤 Uploading {filename} to WorkDrive reports folder...")
+        logger.info("📤 Uploading %s (%d bytes gzipped) to WorkDrive reports folder...", filename, len(report_gz))
         
-        # Placeholder for actual WorkDrive upload
+        # Placeholder for actual WorkDrive upload: send report_gz as the body with
+        # Content-Type: text/html; charset=utf-8 and Content-Encoding: gzip
         mock_report_url = f"https://workdrive.zoho.com/external/shared/{filename}"
         
-        print(f"✅ Report uploaded successfully: {mock_report_url}")
+        logger.info("✅ Report uploaded successfully: %s", mock_report_url)
         return mock_report_url
         
     except Exception as e:
-        print(f"❌ Error uploading report: {e}")
+        logger.error("❌ Error uploading report: %s", e)
         return f"https://workdrive.zoho.com/reports/error_{veteran_info['date']}.html"
 
-def send_notification_email(veteran_info: Dict, report_url: str, analysis: Dict) -> bool:
+async def send_notification_email(veteran_info: Dict, report_url: str, analysis: Dict) -> bool:
     """Send email notification with report link"""
     try:
-        print(f"📧 Email notification sent to: {veteran_info['email']}")
-        print(f"📊 Report URL: {report_url}")
-        print(f"💰 Potential monthly increase: ${analysis.get('executive_summary', {}).get('monthly_increase_potential', 0):,}")
+        logger.info("📧 Email notification sent to: %s", veteran_info['email'])
+        logger.info("📊 Report URL: %s", report_url)
+        logger.info("💰 Potential monthly increase: $%s", analysis.get('executive_summary', {}).get('monthly_increase_potential', 0))
         return True
     except Exception as e:
-        print(f"❌ Error sending email: {e}")
+        logger.error("❌ Error sending email: %s", e)
         return False
 
-def update_crm_record(veteran_info: Dict, analysis: Dict, report_url: str) -> bool:
+async def update_crm_record(veteran_info: Dict, analysis: Dict, report_url: str) -> bool:
     """Update CRM with analysis results"""
     try:
-        print(f"📋 CRM updated for: {veteran_info['name']}")
-        print(f"🎯 Analysis completed with {len(analysis.get('current_service_connected_conditions', []))} conditions reviewed")
+        logger.info("📋 CRM updated for: %s", veteran_info['name'])
+        logger.info("🎯 Analysis completed with %s conditions reviewed", len(analysis.get('current_service_connected_conditions', [])))
         return True
     except Exception as e:
-        print(f"❌ Error updating CRM: {e}")
+        logger.error("❌ Error updating CRM: %s", e)
         return False
 
+@app.before_serving
+async def start_claude_batch_worker():
+    """Start the webhook coalescing worker when batch mode is enabled"""
+    if CLAUDE_BATCH_MODE:
+        app.add_background_task(claude_batch_worker)
+        logger.info("🗂️ Claude batch mode enabled")
+
+async def claude_batch_worker() -> None:
+    """Drain queued analyses into Message Batches submissions"""
+    while True:
+        # Block for the first job, then gather whatever arrives within the window
+        pending = [await claude_batch_queue.get()]
+        deadline = time.monotonic() + CLAUDE_BATCH_WINDOW_SECONDS
+        while len(pending) < CLAUDE_BATCH_MAX_REQUESTS:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending.append(await asyncio.wait_for(claude_batch_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        
+        try:
+            batch = await get_anthropic_client().messages.batches.create(
+                requests=[
+                    {'custom_id': job_id, 'params': build_senior_rater_request(medical_text, veteran_info)}
+                    for job_id, medical_text, veteran_info in pending
+                ]
+            )
+        except Exception as e:
+            logger.error("❌ Claude batch submission failed, analyzing individually: %s", e)
+            app.add_background_task(finish_claude_batch_jobs, pending, {})
+            continue
+        
+        # The batch is accepted (and billed) from here on, so its results are collected
+        # even if recording the submitted status fails
+        logger.info("🗂️ Submitted Claude batch %s with %s analyses", batch.id, len(pending))
+        app.add_background_task(complete_claude_batch, batch.id, pending)
+        try:
+            for job_id, _, _ in pending:
+                update_job('claude_batch_jobs', job_id, status='submitted', batch_id=batch.id)
+        except Exception as e:
+            logger.error("❌ Error recording status of Claude batch %s: %s", batch.id, e)
+
+async def complete_claude_batch(batch_id: str, pending: List[tuple]) -> None:
+    """Wait for a submitted batch to end, then finish every job in it"""
+    client = get_anthropic_client()
+    response_texts = {}
+    try:
+        while (await client.messages.batches.retrieve(batch_id)).processing_status != 'ended':
+            await asyncio.sleep(CLAUDE_BATCH_POLL_SECONDS)
+        
+        async for entry in await client.messages.batches.results(batch_id):
+            if entry.result.type == 'succeeded':
+                response_texts[entry.custom_id] = "".join(
+                    block.text for block in entry.result.message.content if block.type == 'text'
+                )
+        logger.info("🗂️ Claude batch %s ended: %s/%s succeeded", batch_id, len(response_texts), len(pending))
+    except Exception as e:
+        logger.error("❌ Error collecting Claude batch %s: %s", batch_id, e)
+    
+    await finish_claude_batch_jobs(pending, response_texts)
+
+async def finish_claude_batch_jobs(pending: List[tuple], response_texts: Dict[str, str]) -> None:
+    """Run the rest of the pipeline for each job; jobs without batch output are analyzed directly"""
+    await asyncio.gather(*(
+        finish_claude_batch_job(job_id, medical_text, veteran_info, response_texts.get(job_id))
+        for job_id, medical_text, veteran_info in pending
+    ))
+
+async def finish_claude_batch_job(job_id: str, medical_text: str, veteran_info: Dict, response_text: Optional[str]) -> None:
+    """Parse one job's Claude output and deliver its report"""
+    try:
+        if response_text is None:
+            analysis_result = await analyze_medical_records_with_claude(medical_text, veteran_info)
+        else:
+            try:
+                analysis_json = extract_analysis_json(response_text)
+                analysis_result = orjson.loads(analysis_json)
+                cache_analysis(get_analysis_cache_key(medical_text), analysis_json)
+                analysis_result = validate_and_enrich_analysis(analysis_result, veteran_info)
+            except orjson.JSONDecodeError as e:
+                logger.error("❌ JSON parsing error in batch job %s: %s", job_id, e)
+                analysis_result = generate_fallback_analysis(veteran_info)
+        
+        report_gz = render_compressed_report(analysis_result, veteran_info)
+        if not is_fallback_analysis(analysis_result):
+            cache_report(get_report_cache_key(veteran_info['file_id'], medical_text), analysis_result, report_gz)
+        report_url = await deliver_va_report(report_gz, analysis_result, veteran_info)
+        update_job(
+            'claude_batch_jobs', job_id,
+            status='completed',
+            report_url=report_url,
+            completed_at=datetime.now().isoformat()
+        )
+    except Exception as e:
+        logger.error("❌ Error finishing batch job %s: %s", job_id, e)
+        update_job('claude_batch_jobs', job_id, status='failed', error=str(e))
+
+@app.route('/batch-status/<job_id>', methods=['GET'])
+async def batch_status(job_id):
+    """Report the progress of a batch-mode or background-mode analysis"""
+    job = get_job('claude_batch_jobs', job_id) or get_job('pipeline_jobs', job_id)
+    if job is None:
+        return jsonify({'success': False, 'error': f'Unknown batch job: {job_id}'}), 404
+    
+    status = dict(job, job_id=job_id)
+    if job['status'] == 'submitted':
+        try:
+            batch = await get_anthropic_client().messages.batches.retrieve(job['batch_id'])
+            status['batch_processing_status'] = batch.processing_status
+            status['batch_request_counts'] = batch.request_counts.model_dump()
+        except Exception as e:
+            logger.error("❌ Error retrieving Claude batch %s: %s", job['batch_id'], e)
+    
+    return jsonify(status)
+
+@app.route('/reports/<report_id>', methods=['GET'])
+async def serve_report(report_id: str):
+    """Serve a rendered report from the report cache"""
+    cached_report = get_cached_report(get_served_report_cache_key(report_id))
+    if cached_report is None:
+        return jsonify({'success': False, 'error': f'Unknown or expired report: {report_id}'}), 404
+    
+    _, report_gz = cached_report
+    if 'gzip' in request.accept_encodings:
+        response = Response(report_gz, mimetype='text/html')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(zlib.decompress(report_gz, GZIP_WBITS), mimetype='text/html')
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+# Configuration is fixed at import, so everything /test reports except the
+# clock is resolved once instead of on every probe
+TEST_SYSTEM_DETAILS = {
+    'services': {
+        'anthropic': 'configured' if ANTHROPIC_API_KEY != 'your-anthropic-key-here' else 'needs_setup',
+        'zoho': 'configured' if ZOHO_ACCESS_TOKEN != 'your-zoho-token' else 'needs_setup',
+        'workdrive': 'configured' if ZOHO_REPORTS_FOLDER_ID != 'your-reports-folder-id' else 'needs_setup'
+    },
+    'version': '3.0 - Complete Claude Integration',
+    'ai_backend': 'Claude-3.5-Sonnet',
+    'endpoint': '/process-va-records',
+    'features': [
+        'Senior VA Rater Analysis Mode',
+        'Comprehensive Medical Record Review',
+        'CFR Part 4 Compliance',
+        'Combined Rating Calculations',
+        'Benefit-of-the-Doubt Application',
+        'Responsive HTML Reports',
+        'Evidence Gap Analysis',
+        'Strategic Action Planning'
+    ]
+}
+
 @app.route('/test', methods=['GET'])
 def test_system():
     """Test endpoint to verify system configuration"""
     return jsonify({
         'status': 'System operational',
         'timestamp': datetime.now().isoformat(),
-        'services': {
-            'anthropic': 'configured' if ANTHROPIC_API_KEY != 'your-anthropic-key-here' else 'needs_setup',
-            'zoho': 'configured' if ZOHO_ACCESS_TOKEN != 'your-zoho-token' else 'needs_setup',
-            'workdrive': 'configured' if ZOHO_REPORTS_FOLDER_ID != 'your-reports-folder-id' else 'needs_setup'
-        },
-        'version': '3.0 - Complete Claude Integration',
-        'ai_backend': 'Claude-3.5-Sonnet',
-        'endpoint': '/process-va-records',
-        'features': [
-            'Senior VA Rater Analysis Mode',
-            'Comprehensive Medical Record Review',
-            'CFR Part 4 Compliance',
-            'Combined Rating Calculations',
-            'Benefit-of-the-Doubt Application',
-            'Responsive HTML Reports',
-            'Evidence Gap Analysis',
-            'Strategic Action Planning'
-        ]
+        **TEST_SYSTEM_DETAILS
     })
 
 @app.route('/webhook-test', methods=['POST'])
-def webhook_test():
+async def webhook_test():
     """Test endpoint for webhook payload verification"""
+    timestamp = datetime.now().isoformat()
     try:
-        webhook_data = request.json
+        webhook_data = await read_webhook_payload()
+        if webhook_data is None:
+            return jsonify({
+                'webhook_received': False,
+                'error': 'Webhook payload must be a JSON object',
+                'timestamp': timestamp
+            }), 400
         
         return jsonify({
             'webhook_received': True,
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': timestamp,
             'webhook_event': webhook_data.get('webhook_event', 'unknown'),
             'file_info': {
                 'name': webhook_data.get('name', 'unknown'),
@@ -2219,108 +1654,113 @@ def webhook_test():
         return jsonify({
             'webhook_received': False,
             'error': str(e),
-            'timestamp': datetime.now().isoformat()
+            'timestamp': timestamp
         }), 400
 
 @app.route('/analyze-sample', methods=['POST'])
-def analyze_sample():
+async def analyze_sample():
     """Endpoint to test the analysis with sample data"""
-    try:
-        sample_veteran_info = {
-            'name': 'James Grant',
-            'email': 'james.grant@example.com',
-            'filename': 'sample_medical_records.txt',
-            'download_url': 'https://example.com/sample',
-            'file_id': 'sample123',
-            'file_size': '2.5MB',
-            'file_type': 'txt',
-            'uploaded_time': datetime.now().strftime('%m/%d/%Y'),
-            'uploader_email': 'james.grant@example.com',
-            'uploader_name': 'James Grant',
-            'date': datetime.now().strftime('%m%d%Y'),
-            'report_id': f"VAR-SAMPLE-{datetime.now().strftime('%Y%m%d-%H%M%S')}"
-        }
-        
-        # Use sample medical records
-        sample_medical_text = generate_sample_medical_records()
-        
-        # Analyze with Claude
-        analysis_result = analyze_medical_records_with_claude(sample_medical_text, sample_veteran_info)
-        
-        # Generate report
-        report_html = generate_comprehensive_html_report(analysis_result, sample_veteran_info, sample_medical_text)
-        
-        return jsonify({
-            'success': True,
-            'message': 'Sample analysis completed',
-            'veteran_name': sample_veteran_info['name'],
-            'report_id': sample_veteran_info['report_id'],
-            'analysis_summary': {
-                'current_rating': analysis_result.get('executive_summary', {}).get('current_combined_rating', 0),
-                'potential_rating': analysis_result.get('executive_summary', {}).get('potential_combined_rating', 0),
-                'monthly_increase': analysis_result.get('executive_summary', {}).get('monthly_increase_potential', 0),
-                'conditions_analyzed': len(analysis_result.get('current_service_connected_conditions', [])),
-                'new_opportunities': len(analysis_result.get('missed_claiming_opportunities', []))
-            },
-            'report_preview': report_html[:1000] + "...",
-            'timestamp': datetime.now().isoformat()
-        })
-        
-    except Exception as e:
-        return jsonify({
-            'success': False,
-            'error': str(e),
-            'timestamp': datetime.now().isoformat()
-        }), 500
-
-if __name__ == '__main__':
-    # Validate required environment variables on startup
-    required_vars = ['ANTHROPIC_API_KEY', 'ZOHO_ACCESS_TOKEN', 'ZOHO_REPORTS_FOLDER_ID']
-    missing_vars = []
+    now = datetime.now()
+    sample_veteran_info = {
+        'name': 'James Grant',
+        'email': 'james.grant@example.com',
+        'filename': 'sample_medical_records.txt',
+        'download_url': 'https://example.com/sample',
+        'file_id': 'sample123',
+        'file_size': '2.5MB',
+        'file_type': 'txt',
+        'uploaded_time': now.strftime('%m/%d/%Y'),
+        'uploader_email': 'james.grant@example.com',
+        'uploader_name': 'James Grant',
+        'date': now.strftime('%m%d%Y'),
+        'processed_at': now.isoformat(),
+        'report_id': f"VAR-SAMPLE-{now.strftime('%Y%m%d-%H%M%S')}"
+    }
+    
+    # Use sample medical records
+    sample_medical_text = generate_sample_medical_records()
     
-    for var in required_vars:
-        value = os.getenv(var)
-        if not value or value.startswith('your-'):
-            missing_vars.append(var)
+    # Analyze with Claude
+    analysis_result = await analyze_medical_records_with_claude(sample_medical_text, sample_veteran_info)
     
-    if missing_vars:
-        print("⚠️ Missing required environment variables:")
-        for var in missing_vars:
-            print(f"   - {var}")
-        print("\nSet these in your .env file or deployment environment variables")
-        print("\nRequired for full functionality:")
-        print("- ANTHROPIC_API_KEY: Your Anthropic Claude API key")
-        print("- ZOHO_ACCESS_TOKEN: Zoho WorkDrive API access token")
-        print("- ZOHO_REPORTS_FOLDER_ID: Folder ID for storing generated reports")
-        print("- ZOHO_VETREPORTS_FOLDER_ID: Alternative folder ID for reports")
-        print("- ZOHO_MAIL_FROM: Email address for notifications")
+    # ?format=html streams the full report to the browser instead of a JSON summary
+    if request.args.get('format') == 'html':
+        return Response(
+            stream_comprehensive_html_report(analysis_result, sample_veteran_info),
+            mimetype='text/html'
+        )
+    
+    # The full report is served from /reports/<report_id> (gzipped as cached)
+    # rather than JSON-escaping a slice of its HTML into this response
+    cache_report(
+        get_served_report_cache_key(sample_veteran_info['report_id']),
+        analysis_result,
+        render_compressed_report(analysis_result, sample_veteran_info)
+    )
+    summary = analysis_result.get('executive_summary') or {}
+    
+    return jsonify({
+        'success': True,
+        'message': 'Sample analysis completed',
+        'veteran_name': sample_veteran_info['name'],
+        'report_id': sample_veteran_info['report_id'],
+        'analysis_summary': {
+            'current_rating': summary.get('current_combined_rating', 0),
+            'potential_rating': summary.get('potential_combined_rating', 0),
+            'monthly_increase': summary.get('monthly_increase_potential', 0),
+            'conditions_analyzed': len(analysis_result.get('current_service_connected_conditions', [])),
+            'new_opportunities': len(analysis_result.get('missed_claiming_opportunities', []))
+        },
+        'report_url': f"/reports/{sample_veteran_info['report_id']}",
+        'timestamp': now.isoformat()
+    })
+
+# Every server (gunicorn, uvicorn or the dev server below) imports this
+# module, so the configuration check runs at import rather than only under __main__
+if get_missing_config():
+    logger.warning("⚠️ Missing required environment variables: %s", ', '.join(get_missing_config()))
+
+if __name__ == '__main__':
+    # Assemble the whole startup report and write it in one print
+    if get_missing_config():
+        startup_lines = [
+            "\nSet these in your .env file or deployment environment variables",
+            "\nRequired for full functionality:",
+            "- ANTHROPIC_API_KEY: Your Anthropic Claude API key",
+            "- ZOHO_ACCESS_TOKEN: Zoho WorkDrive API access token",
+            "- ZOHO_REPORTS_FOLDER_ID: Folder ID for storing generated reports",
+            "- ZOHO_VETREPORTS_FOLDER_ID: Alternative folder ID for reports",
+            "- ZOHO_MAIL_FROM: Email address for notifications"
+        ]
     else:
-        print("✅ All required environment variables configured")
+        startup_lines = ["✅ All required environment variables configured"]
     
-    print("\n" + "="*80)
-    print("🎖️  VA CLAIMS ANALYSIS SYSTEM - CLAUDE INTEGRATION")
-    print("="*80)
-    print("🤖 AI Backend: Claude-3.5-Sonnet (Anthropic)")
-    print("⚖️  Analysis Mode: Senior VA Claims Rater (GS-13)")
-    print("📋 Features: Comprehensive medical record analysis")
-    print("🎯 Capabilities: CFR Part 4 compliance, benefit maximization")
-    print("📊 Output: Responsive HTML reports with action plans")
-    print("="*80)
-    print("\nEndpoints:")
-    print("- GET  /               : Health check")
-    print("- POST /process-va-records : Main webhook endpoint")
-    print("- GET  /test           : System configuration test")
-    print("- POST /webhook-test   : Webhook payload testing")
-    print("- POST /analyze-sample : Sample analysis testing")
-    print("="*80)
+    startup_lines += [
+        "\n" + "="*80,
+        "🎖️  VA CLAIMS ANALYSIS SYSTEM - CLAUDE INTEGRATION",
+        "="*80,
+        "🤖 AI Backend: Claude-3.5-Sonnet (Anthropic)",
+        "⚖️  Analysis Mode: Senior VA Claims Rater (GS-13)",
+        "📋 Features: Comprehensive medical record analysis",
+        "🎯 Capabilities: CFR Part 4 compliance, benefit maximization",
+        "📊 Output: Responsive HTML reports with action plans",
+        "="*80,
+        "\nEndpoints:",
+        "- GET  /               : Health check",
+        "- POST /process-va-records : Main webhook endpoint",
+        "- GET  /test           : System configuration test",
+        "- POST /webhook-test   : Webhook payload testing",
+        "- POST /analyze-sample : Sample analysis testing",
+        "="*80
+    ]
+    print("\n".join(startup_lines), flush=True)
     
-    # Run the Flask application
+    # Run the Quart application (dev server; use `gunicorn -c gunicorn_conf.py app:app` in production)
     port = int(os.environ.get('PORT', 5000))
     debug_mode = os.environ.get('DEBUG', 'False').lower() == 'true'
     
     app.run(
         debug=debug_mode,
         host='0.0.0.0',
-        port=port,
-        threaded=True
+        port=port
     )
@@ -0,0 +1,23 @@
+# Gunicorn settings for production: gunicorn -c gunicorn_conf.py app:app
+# Quart is ASGI, so each worker runs its own event loop under uvicorn
+
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 5000)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+# Batch and background job status is only shared between workers through the
+# ANALYSIS_CACHE_DB file; without it a /batch-status poll (or a Zoho retry of an
+# in-flight upload) must reach the worker that took the webhook
+job_modes = ('CLAUDE_BATCH_MODE', 'WEBHOOK_BACKGROUND_MODE')
+if any(os.environ.get(mode, 'false').lower() == 'true' for mode in job_modes) and not os.environ.get('ANALYSIS_CACHE_DB'):
+    workers = 1
+# UvicornWorker runs its loop on uvloop whenever it is installed (see requirements.txt)
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+# Import app.py (regexes, Jinja template, prompt constants) once in the master so
+# forked workers share those pages copy-on-write; HTTP clients are built per worker
+preload_app = True
+
+# Outlive the load balancer's idle timeout so Zoho's keep-alive connections are reused
+keepalive = 75